@@ -0,0 +1,118 @@
+import time
+
+
+def compile_rule(rule):
+    """Turn a rule definition into an evaluator closure.
+
+    A rule is a dict with:
+      name      unique rule name
+      metric    callable returning the current value (or None when unknown)
+      trigger   value at which the alert activates
+      clear     value at which it clears again (hysteresis), defaults to trigger
+      above     True to alert when value >= trigger, False when value <= trigger
+      debounce  seconds the condition must hold before the state flips
+      severity  log type used when the alert activates ('warning' or 'error')
+      action    optional flight mode to switch to when the alert activates
+      message   format string, receives {value} and {trigger}
+      inputs    MAVLink message types that can change the metric, or None to
+                evaluate on every update (time based rules)
+
+    The evaluator returns an alert dict when the rule changes state and None
+    otherwise.
+    """
+    name = rule['name']
+    metric = rule['metric']
+    trigger = rule['trigger']
+    clear = rule.get('clear', trigger)
+    debounce = rule.get('debounce', 0.0)
+    severity = rule.get('severity', 'warning')
+    action = rule.get('action')
+    message = rule.get('message', name + ': {value}')
+
+    if rule.get('above', True):
+        def should_activate(value):
+            return value >= trigger
+
+        def should_clear(value):
+            return value <= clear
+    else:
+        def should_activate(value):
+            return value <= trigger
+
+        def should_clear(value):
+            return value >= clear
+
+    state = {'active': False, 'pending_since': None}
+
+    def evaluate(now):
+        value = metric()
+        if value is None:
+            state['pending_since'] = None
+            return None
+
+        flipping = should_clear(value) if state['active'] else should_activate(value)
+        if not flipping:
+            state['pending_since'] = None
+            return None
+
+        if state['pending_since'] is None:
+            state['pending_since'] = now
+        if now - state['pending_since'] < debounce:
+            return None
+
+        state['active'] = not state['active']
+        state['pending_since'] = None
+        return {
+            'rule': name,
+            'active': state['active'],
+            'severity': severity if state['active'] else 'info',
+            'message': message.format(value=value, trigger=trigger) if state['active']
+                       else f"Cleared: {message.format(value=value, trigger=trigger)}",
+            'value': value,
+            'action': action if state['active'] else None,
+            'timestamp': int(now * 1000)
+        }
+
+    evaluate.rule_name = name
+    evaluate.is_active = lambda: state['active']
+    return evaluate
+
+
+class AlertEngine:
+    """Evaluates compiled alert rules incrementally as telemetry arrives"""
+
+    def __init__(self, rules, on_alert):
+        self.on_alert = on_alert
+        self.evaluators = []
+        self.by_input = {}
+        self.every_update = []
+
+        for rule in rules:
+            evaluator = compile_rule(rule)
+            self.evaluators.append(evaluator)
+            inputs = rule.get('inputs')
+            if inputs is None:
+                self.every_update.append(evaluator)
+            else:
+                for msg_type in inputs:
+                    self.by_input.setdefault(msg_type, []).append(evaluator)
+
+    def update(self, msg_type=None, now=None):
+        """Evaluate the rules affected by msg_type plus the time based rules"""
+        now = time.time() if now is None else now
+        for evaluator in self.by_input.get(msg_type, ()):
+            self._run(evaluator, now)
+        for evaluator in self.every_update:
+            self._run(evaluator, now)
+
+    def _run(self, evaluator, now):
+        try:
+            alert = evaluator(now)
+        except Exception as e:
+            print(f"Alert rule {evaluator.rule_name} failed: {str(e)}")
+            return
+        if alert:
+            self.on_alert(alert)
+
+    def active_alerts(self):
+        return [e.rule_name for e in self.evaluators if e.is_active()]
@@ -0,0 +1,124 @@
+import math
+
+
+class EWRegression:
+    """Exponentially weighted least-squares line fit y = a + b*x with time decay"""
+
+    def __init__(self, time_constant):
+        self.time_constant = time_constant
+        self.last_t = None
+        self.s0 = self.sx = self.sy = self.sxx = self.sxy = 0.0
+        self.span = 0.0
+
+    def add(self, t, x, y):
+        if self.last_t is not None:
+            dt = max(t - self.last_t, 0.0)
+            decay = math.exp(-dt / self.time_constant)
+            self.s0 *= decay
+            self.sx *= decay
+            self.sy *= decay
+            self.sxx *= decay
+            self.sxy *= decay
+            self.span = self.span * decay + dt
+        self.last_t = t
+        self.s0 += 1.0
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.sxy += x * y
+
+    def slope(self):
+        denominator = self.s0 * self.sxx - self.sx * self.sx
+        if self.s0 < 3 or abs(denominator) < 1e-12:
+            return None
+        return (self.s0 * self.sxy - self.sx * self.sy) / denominator
+
+
+class BatteryEstimator:
+    """Streaming time-to-empty estimate from SYS_STATUS samples.
+
+    With a current sensor the remaining percentage is regressed against the
+    charge drawn (A*s), which gives a stable %/A*s factor that is multiplied by
+    the smoothed current. Without current the percentage (or, if the autopilot
+    reports no percentage, the voltage) is regressed against time.
+    """
+
+    def __init__(self, reserve_percent=20, empty_voltage=None, time_constant=60.0,
+                 min_span=20.0):
+        self.reserve_percent = reserve_percent
+        self.empty_voltage = empty_voltage
+        self.min_span = min_span
+        self.time_constant = time_constant
+        self.by_charge = EWRegression(time_constant)
+        self.by_time = EWRegression(time_constant)
+        self.voltage_by_time = EWRegression(time_constant)
+        self.charge = 0.0
+        self.current = None
+        self.percent = None
+        self.voltage = None
+        self.last_t = None
+        self.start_t = None
+
+    def reset(self):
+        self.__init__(self.reserve_percent, self.empty_voltage, self.time_constant, self.min_span)
+
+    def update(self, t, percent, voltage, current):
+        """Add a sample; percent < 0 and current < 0 mean 'not reported' as in MAVLink"""
+        if self.start_t is None:
+            self.start_t = t
+        if self.last_t is not None and t <= self.last_t:
+            return
+        dt = t - self.last_t if self.last_t is not None else 0.0
+        self.last_t = t
+        elapsed = t - self.start_t
+
+        if current is not None and current >= 0:
+            self.charge += current * dt
+            alpha = 1.0 - math.exp(-dt / 10.0) if self.current is not None else 1.0
+            self.current = current if self.current is None else self.current + alpha * (current - self.current)
+        else:
+            self.current = None
+
+        self.voltage = voltage
+        if voltage:
+            self.voltage_by_time.add(t, elapsed, voltage)
+
+        if percent is not None and percent >= 0:
+            if self.percent is not None and percent > self.percent + 5:
+                # Battery swapped or recalibrated, start a fresh fit
+                self.reset()
+                self.update(t, percent, voltage, current)
+                return
+            self.percent = percent
+            self.by_time.add(t, elapsed, percent)
+            if self.current is not None:
+                self.by_charge.add(t, self.charge, percent)
+        else:
+            self.percent = None
+
+    def discharge_rate(self):
+        """Percent per second, positive while discharging"""
+        if self.current is not None and self.by_charge.span >= self.min_span:
+            per_charge = self.by_charge.slope()
+            if per_charge is not None and per_charge < 0:
+                return -per_charge * self.current
+        if self.by_time.span >= self.min_span:
+            per_second = self.by_time.slope()
+            if per_second is not None and per_second < 0:
+                return -per_second
+        return None
+
+    def time_to_empty(self):
+        """Seconds until the reserve is reached, or None while the fit is not ready"""
+        if self.percent is not None:
+            rate = self.discharge_rate()
+            if rate is None or rate <= 0:
+                return None
+            return max(self.percent - self.reserve_percent, 0.0) / rate
+
+        if self.empty_voltage and self.voltage and self.voltage_by_time.span >= self.min_span:
+            volts_per_second = self.voltage_by_time.slope()
+            if volts_per_second is None or volts_per_second >= 0:
+                return None
+            return max(self.voltage - self.empty_voltage, 0.0) / -volts_per_second
+        return None
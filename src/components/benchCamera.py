@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+"""Benchmark MJPEG frame parsing at the camera resolutions we use.
+
+Writes a synthetic MJPEG stream (random entropy data between SOI/EOI markers,
+sized like real libcamera-vid output) to a temp file and parses it with the
+old BytesIO approach and the incremental JpegFrameScanner. Reports parse
+throughput in MB/s and the CPU a single core would spend at the camera's
+real byte rate.
+
+--pipeline runs the whole CameraService against syntheticCamera.py instead
+(or --source FILE to replay a recording), so it works on any Linux box: it
+reports the delivered frame rate, frames lost between the source and a
+consumer (from the counter drawn into each synthetic frame), startup time
+and capture-to-publish latency. --webrtc also pulls frames through
+LibcameraVideoStreamTrack and reports its decoded frame rate.
+
+    python benchCamera.py [--seconds 10]
+    python benchCamera.py --pipeline [--webrtc] [--codec h264] [--source flight.mjpeg]
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import tempfile
+import time
+
+from cameraPipeline import CameraService, JpegFrameScanner
+from videoStats import stats
+
+try:
+    import cv2
+    import numpy as np
+    from syntheticCamera import read_counter
+except ImportError:  # Lost frames are only counted with OpenCV
+    cv2 = None
+
+# (label, width, height, framerate, typical JPEG size in bytes)
+PROFILES = [
+    ('640x480@40', 640, 480, 40, 45 * 1024),
+    ('1296x972@20', 1296, 972, 20, 180 * 1024),
+]
+
+
+def synthetic_jpeg(size, rng):
+    """SOI + stuffed random payload + EOI, so 0xff 0xd9 only appears at the end"""
+    payload = bytearray(rng.getrandbits(8) for _ in range(size))
+    payload = payload.replace(b'\xff', b'\xff\x00')
+    return b'\xff\xd8' + bytes(payload) + b'\xff\xd9'
+
+
+def write_stream(path, frame_size, frame_count):
+    rng = random.Random(0)
+    templates = [synthetic_jpeg(frame_size, rng) for _ in range(4)]
+    with open(path, 'wb') as f:
+        for i in range(frame_count):
+            f.write(templates[i % len(templates)])
+    return os.path.getsize(path)
+
+
+def parse_bytesio(path, chunk_size=4096):
+    """The previous CameraStream._capture loop"""
+    frames = 0
+    with open(path, 'rb', buffering=0) as stream:
+        buffer = io.BytesIO()
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            buffer.write(chunk)
+            buffer_str = buffer.getvalue()
+            start = buffer_str.find(b'\xff\xd8')
+            end = buffer_str.find(b'\xff\xd9')
+            if start != -1 and end != -1 and end > start:
+                frames += 1
+                buffer = io.BytesIO()
+                buffer.write(buffer_str[end + 2:])
+    return frames
+
+
+def parse_scanner(path):
+    frames = 0
+    scanner = JpegFrameScanner()
+    with open(path, 'rb', buffering=0) as stream:
+        while scanner.read_from(stream):
+            for _ in scanner.frames():
+                frames += 1
+    return frames
+
+
+def measure(parser, path, size):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    frames = parser(path)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    return frames, size / wall / 1e6, cpu / size
+
+
+def run_consumer(camera, seconds, count_lost):
+    """Frames received by a queue consumer, and how many the counter says went missing"""
+    consumer = camera.subscribe('bench', policy='queue', maxsize=camera.framerate * 10)
+    frames = lost = 0
+    last_number = None
+    deadline = time.time() + seconds
+    try:
+        while time.time() < deadline:
+            frame = consumer.get(timeout=1.0)
+            if frame is None:
+                continue
+            frames += 1
+            if count_lost:
+                gray = cv2.imdecode(np.frombuffer(frame.data, np.uint8), cv2.IMREAD_GRAYSCALE)
+                number = read_counter(gray)
+                if last_number is not None and number > last_number + 1:
+                    lost += number - last_number - 1
+                last_number = number
+    finally:
+        camera.unsubscribe(consumer)
+    return frames, lost + consumer.dropped
+
+
+async def pull_track(track, seconds):
+    frames = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        await track.recv()
+        frames += 1
+    return frames
+
+
+def run_webrtc(camera, seconds):
+    from webrtcStream import LibcameraVideoStreamTrack
+
+    async def bench():
+        track = LibcameraVideoStreamTrack(camera.width, camera.height, camera.framerate, camera=camera)
+        try:
+            return await pull_track(track, seconds)
+        finally:
+            track.stop()
+    return asyncio.run(bench())
+
+
+def bench_pipeline(args):
+    source = args.source or 'synthetic'
+    count_lost = cv2 is not None and source == 'synthetic' and args.codec == 'mjpeg'
+    print(f"{'profile':<14}{'consumer':<10}{'frames':>8}{'fps':>8}{'lost':>8}"
+          f"{'startup ms':>12}{'publish p50/p99 ms':>22}")
+    for label, width, height, framerate, _ in PROFILES:
+        stats.reset()
+        camera = CameraService(width, height, framerate, codec=args.codec, source=source)
+        camera.start()
+        try:
+            runs = [('queue', lambda: run_consumer(camera, args.seconds, count_lost))]
+            if args.webrtc and args.codec == 'mjpeg':
+                runs.append(('webrtc', lambda: (run_webrtc(camera, args.seconds), None)))
+            for name, run in runs:
+                frames, lost = run()
+                latency = stats.snapshot()['latency_ms']
+                startup = latency.get('startup', {}).get('max', '-')
+                published = latency.get('published', {})
+                print(f"{label:<14}{name:<10}{frames:>8}{frames / args.seconds:>8.1f}"
+                      f"{'-' if lost is None else lost:>8}{startup:>12}"
+                      f"{published.get('p50', '-'):>11}/{published.get('p99', '-')}")
+        finally:
+            camera.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10, help='seconds of video per profile')
+    parser.add_argument('--pipeline', action='store_true', help='benchmark CameraService on a synthetic source')
+    parser.add_argument('--webrtc', action='store_true', help='with --pipeline, also pull frames through the WebRTC track')
+    parser.add_argument('--codec', choices=['mjpeg', 'h264'], default='mjpeg')
+    parser.add_argument('--source', help='MJPEG/H.264 file to replay instead of the synthetic pattern')
+    args = parser.parse_args()
+
+    if args.pipeline:
+        bench_pipeline(args)
+        return
+
+    print(f"{'profile':<14}{'parser':<10}{'frames':>8}{'MB/s':>10}{'CPU @ camera rate':>20}")
+    for label, width, height, framerate, frame_size in PROFILES:
+        frame_count = int(args.seconds * framerate)
+        with tempfile.NamedTemporaryFile(suffix='.mjpeg', delete=False) as tmp:
+            path = tmp.name
+        try:
+            size = write_stream(path, frame_size, frame_count)
+            camera_rate = size / args.seconds
+            for name, fn in (('bytesio', parse_bytesio), ('scanner', parse_scanner)):
+                frames, mbps, cpu_per_byte = measure(fn, path, size)
+                cpu_percent = 100.0 * cpu_per_byte * camera_rate
+                print(f"{label:<14}{name:<10}{frames:>8}{mbps:>10.1f}{cpu_percent:>19.2f}%")
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
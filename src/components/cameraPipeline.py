@@ -0,0 +1,738 @@
+import collections
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # Variants need OpenCV, plain streaming does not
+    cv2 = None
+    np = None
+
+from videoStats import stats
+
+logger = logging.getLogger(__name__)
+
+# Where frames come from: 'libcamera' (the Pi camera), 'synthetic' (generated
+# test pattern) or the path of an MJPEG/H.264 file to replay at the framerate
+CAMERA_SOURCE = os.environ.get('CAMERA_SOURCE', 'libcamera')
+SYNTHETIC_CAMERA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'syntheticCamera.py')
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
+
+class JpegFrameScanner:
+    """Incremental MJPEG splitter.
+
+    Bytes are appended to one reusable bytearray and the marker search resumes
+    where the previous one stopped, so each byte is scanned once no matter how
+    many reads a frame takes. Complete frames are returned as a single bytes
+    copy and dropped from the front of the buffer.
+    """
+
+    def __init__(self, chunk_size=65536, max_frame_size=8 * 1024 * 1024):
+        self.buffer = bytearray()
+        self.chunk = bytearray(chunk_size)
+        self.chunk_view = memoryview(self.chunk)
+        self.max_frame_size = max_frame_size
+        self.frame_start = -1
+        self.search_from = 0
+
+    def read_from(self, stream):
+        """Read one chunk from a raw (unbuffered) stream, returns the byte count (0 on EOF)"""
+        n = stream.readinto(self.chunk_view)
+        if n:
+            self.buffer += self.chunk_view[:n]
+        return n or 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def frames(self):
+        """Yield every complete JPEG currently in the buffer"""
+        buffer = self.buffer
+        while True:
+            if self.frame_start < 0:
+                start = buffer.find(JPEG_SOI, self.search_from)
+                if start < 0:
+                    # Keep a trailing 0xff in case the marker is split across reads
+                    keep = 1 if buffer.endswith(b'\xff') else 0
+                    del buffer[:len(buffer) - keep]
+                    self.search_from = 0
+                    return
+                self.frame_start = start
+                self.search_from = start + 2
+
+            end = buffer.find(JPEG_EOI, self.search_from)
+            if end < 0:
+                if len(buffer) - self.frame_start > self.max_frame_size:
+                    logger.warning("Dropping oversized JPEG frame")
+                    del buffer[:]
+                    self.frame_start = -1
+                    self.search_from = 0
+                    return
+                # Resume at the last byte, the marker may straddle the next read
+                self.search_from = max(len(buffer) - 1, self.search_from)
+                return
+
+            with memoryview(buffer) as view:
+                frame = view[self.frame_start:end + 2].tobytes()
+            del buffer[:end + 2]
+            self.frame_start = -1
+            self.search_from = 0
+            yield frame
+
+
+H264_START_CODE = b'\x00\x00\x01'
+H264_NAL_IDR = 5
+H264_VCL_TYPES = (1, 5)
+# SEI, SPS, PPS and access unit delimiter always open a new access unit
+H264_AU_START_TYPES = (6, 7, 8, 9)
+
+
+class H264AccessUnitParser:
+    """Incremental Annex-B splitter that groups NAL units into access units.
+
+    An access unit ends when, after its first slice, a parameter set, SEI or
+    delimiter arrives, or a slice with first_mb_in_slice == 0 starts the next
+    picture. With single_slice (libcamera-vid and the synthetic camera encode
+    each picture as one slice) the unit is emitted as soon as its slice is
+    complete instead of waiting for the next picture. A NAL unit is only
+    known to be complete once the next start code arrives, so that is the
+    earliest point. frames() yields (access_unit_bytes, is_keyframe).
+    """
+
+    def __init__(self, chunk_size=65536, max_nal_size=8 * 1024 * 1024, single_slice=False):
+        self.buffer = bytearray()
+        self.chunk = bytearray(chunk_size)
+        self.chunk_view = memoryview(self.chunk)
+        self.max_nal_size = max_nal_size
+        self.single_slice = single_slice
+        self.nal_payload = -1
+        self.search_from = 0
+        self.au_nals = []
+        self.au_has_vcl = False
+        self.au_keyframe = False
+
+    def read_from(self, stream):
+        """Read one chunk from a raw (unbuffered) stream, returns the byte count (0 on EOF)"""
+        n = stream.readinto(self.chunk_view)
+        if n:
+            self.buffer += self.chunk_view[:n]
+        return n or 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def _add_nal(self, nal):
+        if not nal:
+            return None
+        nal_type = nal[0] & 0x1f
+        is_vcl = nal_type in H264_VCL_TYPES
+        # first_mb_in_slice is ue(v); a leading 1 bit means 0, i.e. a new picture
+        first_slice = is_vcl and len(nal) > 1 and nal[1] & 0x80
+
+        access_unit = None
+        if self.au_has_vcl and (nal_type in H264_AU_START_TYPES or first_slice):
+            access_unit = self._take_access_unit()
+
+        self.au_nals.append(nal)
+        if is_vcl:
+            self.au_has_vcl = True
+            if nal_type == H264_NAL_IDR:
+                self.au_keyframe = True
+            if self.single_slice and first_slice and access_unit is None:
+                # The picture's only slice is in, nothing else belongs to it
+                access_unit = self._take_access_unit()
+        return access_unit
+
+    def _take_access_unit(self):
+        access_unit = (b''.join(b'\x00\x00\x00\x01' + n for n in self.au_nals), self.au_keyframe)
+        self.au_nals = []
+        self.au_has_vcl = False
+        self.au_keyframe = False
+        return access_unit
+
+    def frames(self):
+        """Yield every access unit completed by the bytes currently buffered"""
+        buffer = self.buffer
+        while True:
+            p = buffer.find(H264_START_CODE, self.search_from)
+            if p < 0:
+                if self.nal_payload >= 0 and len(buffer) - self.nal_payload > self.max_nal_size:
+                    logger.warning("Dropping oversized H.264 NAL unit")
+                    del buffer[:]
+                    self.nal_payload = -1
+                    self.search_from = 0
+                    return
+                # A start code may straddle the next read
+                self.search_from = max(len(buffer) - 2, self.search_from, 0)
+                return
+
+            if self.nal_payload < 0:
+                # Skip anything before the first start code
+                del buffer[:p]
+                self.nal_payload = self.search_from = 3
+                continue
+
+            # Trailing zeros belong to the next (4-byte) start code
+            end = p
+            while end > self.nal_payload and buffer[end - 1] == 0:
+                end -= 1
+            with memoryview(buffer) as view:
+                nal = view[self.nal_payload:end].tobytes()
+            del buffer[:p]
+            self.nal_payload = self.search_from = 3
+
+            access_unit = self._add_nal(nal)
+            if access_unit:
+                yield access_unit
+
+
+class FrameHub:
+    """Latest-frame broadcast point.
+
+    Every published frame gets a sequence number. Readers wait on a condition
+    variable for a sequence newer than the one they last saw, so they wake
+    exactly once per new frame and skip straight to the newest frame when
+    they fall behind.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.timestamp = None
+        self.subscribers = 0
+        self.closed = False
+
+    def publish(self, frame, timestamp=None):
+        with self.condition:
+            self.frame = frame
+            self.seq += 1
+            self.timestamp = timestamp if timestamp is not None else time.time()
+            self.condition.notify_all()
+
+    def latest(self):
+        with self.condition:
+            return self.seq, self.frame
+
+    def snapshot(self):
+        """(seq, timestamp, frame) of the newest frame, read atomically"""
+        with self.condition:
+            return self.seq, self.timestamp, self.frame
+
+    def wait_for_frame(self, last_seq, timeout=None):
+        """Block until a frame newer than last_seq exists; returns (seq, timestamp, frame) like
+        snapshot(), timestamp and frame are None on timeout"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq != last_seq or self.closed, timeout):
+                return last_seq, None, None
+            if self.closed:
+                return last_seq, None, None
+            return self.seq, self.timestamp, self.frame
+
+    def add_subscriber(self):
+        with self.condition:
+            self.subscribers += 1
+            return self.subscribers
+
+    def remove_subscriber(self):
+        with self.condition:
+            self.subscribers = max(self.subscribers - 1, 0)
+            return self.subscribers
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# Supervisor: how often it checks the capture, how long libcamera-vid gets to
+# deliver its first frame, and the restart backoff range in seconds
+SUPERVISOR_POLL = 0.25
+STARTUP_TIMEOUT = 5.0
+RESTART_BACKOFF_MIN = 0.5
+RESTART_BACKOFF_MAX = 30.0
+# A session that streamed this long resets the backoff
+HEALTHY_SESSION = 30.0
+# Keep capturing this long after the last consumer leaves, so a viewer that
+# reconnects (or the next /snapshot) does not wait for libcamera-vid to start
+CAPTURE_LINGER = 10.0
+# _watch() results when the capture was stopped for lack of consumers, or
+# to relaunch it with a new configuration
+IDLE = 'idle'
+RECONFIGURE = 'reconfigure'
+
+
+# One captured frame as handed to consumers
+Frame = collections.namedtuple('Frame', ['seq', 'timestamp', 'data', 'keyframe'], defaults=(True,))
+
+
+class FrameConsumer:
+    """Per-consumer frame queue fed by the capture thread.
+
+    policy='latest' keeps only the newest frame (live viewers, analytics);
+    policy='queue' keeps up to maxsize frames and drops the oldest when full
+    (recorders that want every frame but must never stall capture).
+    Consumers that decode frames can be told to take only every Nth one
+    (CameraService.throttle_decoders) to save CPU.
+    """
+
+    def __init__(self, name, policy='latest', maxsize=1, decodes=False):
+        self.name = name
+        self.policy = policy
+        self.decodes = decodes
+        self.frames = collections.deque(maxlen=1 if policy == 'latest' else maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+        self.every = 1
+        self.offered = 0
+
+    def put(self, frame):
+        with self.condition:
+            self.offered += 1
+            if self.offered % self.every:
+                return
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Next frame for this consumer, or None on timeout / close"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frames or self.closed, timeout):
+                return None
+            if not self.frames:
+                return None
+            return self.frames.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class CameraService:
+    """Owns the single libcamera-vid process and fans frames out.
+
+    Every frame is read and split once, then published to the FrameHub (for
+    MJPEG HTTP clients) and to every registered FrameConsumer (WebRTC tracks,
+    recorder, analytics), each with its own queue policy.
+
+    A supervisor thread watches frame inter-arrival time. When libcamera-vid
+    exits or stalls it is killed and restarted with exponential backoff,
+    while the hub keeps serving the last good frame.
+
+    Capture is demand driven: libcamera-vid only runs while something holds
+    the camera through acquire() (subscribe() does this for consumers) and
+    is stopped once it has been unused for linger seconds. The hub stays
+    open in between, so the last frame remains available.
+
+    reconfigure() changes resolution and frame rate the same way: consumers
+    stay subscribed and see the last frame held while libcamera-vid is
+    relaunched with the new arguments.
+    """
+
+    def __init__(self, width=640, height=480, framerate=30, codec='mjpeg', linger=CAPTURE_LINGER,
+                 source=CAMERA_SOURCE):
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.codec = codec
+        self.source = source
+        self.hub = FrameHub()
+        self.consumers = []
+        self.consumers_lock = threading.Lock()
+        # Decoding consumers take every Nth frame, see throttle_decoders()
+        self.decode_every = 1
+        self.variants = {}
+        self.variants_lock = threading.Lock()
+        self.process = None
+        # Guards swapping in a new process against publish() from the old one's reader
+        self.process_lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.stop_event = threading.Event()
+        self.frame_count = 0
+        self.started_at = time.time()
+        # Frames arriving further apart than this count as a stall
+        self.stall_timeout = max(2.0, 10.0 / framerate)
+        self.last_frame_time = 0
+        self.restarts = 0
+        self.downtime = 0.0
+        self.down_since = None
+        self.last_restart_reason = None
+        self.linger = linger
+        self.demand = 0
+        self.demand_changed = threading.Condition()
+        self.idle_since = time.time()
+        self.launched_at = None
+        self.reconfigured = False
+        # Mode to fall back to if the new one never produces a frame
+        self.previous_config = None
+
+    def command(self):
+        if self.source == 'libcamera':
+            command = ['libcamera-vid']
+        else:
+            # Same arguments and output format, see syntheticCamera.py
+            command = [sys.executable, SYNTHETIC_CAMERA]
+            if self.source != 'synthetic':
+                command += ['--replay', self.source]
+        command += [
+            '-t', '0',                       # Run indefinitely
+            '--inline',                      # Repeat stream headers
+            '--width', str(self.width),
+            '--height', str(self.height),
+            '--framerate', str(self.framerate),
+            '--codec', self.codec,
+            '--output', '-'                  # Output to stdout
+        ]
+        if self.codec == 'h264':
+            # Baseline profile for browser decoders, a keyframe every second
+            command += ['--profile', 'baseline', '--intra', str(self.framerate)]
+        return command
+
+    def start(self):
+        if self.thread is None:
+            logger.info("Starting camera capture: " + " ".join(self.command()))
+            self.running = True
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._supervise, daemon=True)
+            self.thread.start()
+
+    def acquire(self, name):
+        """Register a user of the capture, starting it if it is not running"""
+        with self.demand_changed:
+            self.demand += 1
+            if self.demand == 1:
+                logger.info(f"Camera wanted by {name}")
+                self.demand_changed.notify_all()
+
+    def release(self, name):
+        with self.demand_changed:
+            self.demand = max(0, self.demand - 1)
+            if self.demand == 0:
+                self.idle_since = time.time()
+                logger.info(f"Camera released by {name}, stopping in {self.linger:.0f}s unless wanted again")
+
+    def config(self):
+        return {'width': self.width, 'height': self.height, 'framerate': self.framerate, 'codec': self.codec}
+
+    def reconfigure(self, width=None, height=None, framerate=None):
+        """Relaunch the capture with a new mode, keeping every consumer and the held frame"""
+        with self.demand_changed:
+            if self.previous_config is None:
+                # Keep the last mode that produced frames, not one still being tried
+                self.previous_config = (self.width, self.height, self.framerate)
+            self.width = width or self.width
+            self.height = height or self.height
+            self.framerate = framerate or self.framerate
+            self.stall_timeout = max(2.0, 10.0 / self.framerate)
+            self.reconfigured = True
+        logger.info(f"Camera reconfigured to {self.width}x{self.height}@{self.framerate}")
+
+    def _wait_for_demand(self):
+        """Block until the capture is wanted; False when stopping"""
+        with self.demand_changed:
+            if self.demand == 0 and self.down_since is not None:
+                # Nobody is missing frames while the camera is idle
+                self.downtime += time.time() - self.down_since
+                self.down_since = None
+            self.demand_changed.wait_for(lambda: self.demand > 0 or not self.running)
+        return self.running
+
+    def _supervise(self):
+        backoff = RESTART_BACKOFF_MIN
+        while self._wait_for_demand():
+            session_start = time.time()
+            self.reconfigured = False
+            reader = None
+            try:
+                # Unbuffered pipe so readinto returns whatever is available
+                process = subprocess.Popen(
+                    self.command(),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    bufsize=0
+                )
+                with self.process_lock:
+                    self.process = process
+                    self.launched_at = session_start
+                logger.info("Camera process started")
+                reader = threading.Thread(target=self._capture, args=(self.process,), daemon=True)
+                reader.start()
+                reason = self._watch(session_start)
+            except Exception as e:
+                reason = f"failed to start: {str(e)}"
+
+            self._kill_process()
+            if reader:
+                reader.join(timeout=2)
+            if not self.running:
+                break
+            if reason == IDLE:
+                logger.info("Camera stopped, nobody is using it")
+                backoff = RESTART_BACKOFF_MIN
+                continue
+            if reason == RECONFIGURE:
+                backoff = RESTART_BACKOFF_MIN
+                continue
+
+            if self.previous_config and self.last_frame_time < session_start:
+                # The new mode never worked, go back to the one that did
+                self.width, self.height, self.framerate = self.previous_config
+                self.stall_timeout = max(2.0, 10.0 / self.framerate)
+                self.previous_config = None
+                logger.warning(f"Camera mode failed, reverting to {self.width}x{self.height}@{self.framerate}")
+            if self.down_since is None:
+                self.down_since = self.last_frame_time if self.last_frame_time > session_start else time.time()
+            if self.last_frame_time - session_start > HEALTHY_SESSION:
+                backoff = RESTART_BACKOFF_MIN
+            self.restarts += 1
+            self.last_restart_reason = reason
+            logger.warning(f"Camera {reason}, restart #{self.restarts} in {backoff:.1f}s")
+            if self.stop_event.wait(backoff):
+                break
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    def _watch(self, session_start):
+        """Block until the capture dies or stalls; returns the reason, or None when stopping"""
+        while not self.stop_event.wait(SUPERVISOR_POLL):
+            code = self.process.poll()
+            if code is not None:
+                return f"process exited with code {code}"
+            now = time.time()
+            if self.demand == 0 and now - self.idle_since > self.linger:
+                return IDLE
+            if self.reconfigured:
+                return RECONFIGURE
+            if self.last_frame_time < session_start:
+                if now - session_start > STARTUP_TIMEOUT:
+                    return "produced no frames"
+            elif now - self.last_frame_time > self.stall_timeout:
+                return f"stalled for {now - self.last_frame_time:.1f}s"
+        return None
+
+    def _kill_process(self):
+        process = self.process
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            logger.info("Camera process terminated")
+
+    def _capture(self, process):
+        try:
+            if self.codec == 'h264':
+                # Replayed files may use several slices per picture
+                parser = H264AccessUnitParser(single_slice=self.source in ('libcamera', 'synthetic'))
+            else:
+                parser = JpegFrameScanner()
+
+            while self.running:
+                if not parser.read_from(process.stdout):
+                    break
+                # Frames are timestamped with the read that completed them
+                read_time = time.time()
+
+                frames = parser.frames()
+                while True:
+                    # Time the parser alone, not the publish of the previous frame
+                    parse_start = time.time()
+                    item = next(frames, None)
+                    if item is None:
+                        break
+                    stats.record('parse_time', parse_start)
+                    if self.codec == 'h264':
+                        self.publish(item[0], read_time, item[1], process)
+                    else:
+                        self.publish(item, read_time, process=process)
+
+        except Exception as e:
+            logger.error(f"Error in capture thread: {str(e)}")
+
+    def publish(self, data, timestamp, keyframe=True, process=None):
+        with self.process_lock:
+            if process is not None and process is not self.process:
+                return  # Left in the pipe of a process that was replaced, e.g. the old mode
+            if self.launched_at is not None:
+                # Time from launching libcamera-vid to its first frame, which
+                # also confirms the mode it was launched with
+                stats.record('startup', self.launched_at, timestamp)
+                self.launched_at = None
+                self.previous_config = None
+            self.last_frame_time = timestamp
+        if self.down_since is not None:
+            self.downtime += timestamp - self.down_since
+            logger.info(f"Camera recovered after {timestamp - self.down_since:.1f}s")
+            self.down_since = None
+        self.frame_count += 1
+        frame = Frame(self.frame_count, timestamp, data, keyframe)
+        self.hub.publish(data, timestamp)
+        with self.consumers_lock:
+            consumers = list(self.consumers)
+        for consumer in consumers:
+            consumer.put(frame)
+        stats.record('published', timestamp)
+        stats.tick('capture')
+
+    def subscribe(self, name, policy='latest', maxsize=1, decodes=False):
+        consumer = FrameConsumer(name, policy, maxsize, decodes)
+        with self.consumers_lock:
+            if decodes:
+                consumer.every = self.decode_every
+            self.consumers.append(consumer)
+        logger.info(f"Camera consumer added: {name} ({policy})")
+        self.acquire(name)
+        return consumer
+
+    def unsubscribe(self, consumer):
+        consumer.close()
+        with self.consumers_lock:
+            if consumer not in self.consumers:
+                return
+            self.consumers.remove(consumer)
+        logger.info(f"Camera consumer removed: {consumer.name}")
+        self.release(consumer.name)
+
+    def throttle_decoders(self, every):
+        """Feed consumers that decode (WebRTC MJPEG track, variants) only every Nth frame"""
+        with self.consumers_lock:
+            self.decode_every = every
+            for consumer in self.consumers:
+                if consumer.decodes:
+                    consumer.every = every
+
+    def get_frame(self):
+        return self.hub.latest()[1]
+
+    def health(self):
+        now = time.time()
+        downtime = self.downtime + (now - self.down_since if self.down_since is not None else 0.0)
+        process = self.process
+        capturing = self.running and process is not None and process.poll() is None
+        return {
+            'running': self.running,
+            'capturing': capturing,
+            'demand': self.demand,
+            'streaming': capturing and now - self.last_frame_time <= self.stall_timeout,
+            'last_frame_age': round(now - self.last_frame_time, 2) if self.last_frame_time else None,
+            'restarts': self.restarts,
+            'downtime': round(downtime, 1),
+            'last_restart_reason': self.last_restart_reason
+        }
+
+    def get_variant(self, width, quality):
+        """Shared lower-resolution stream, created on first use and started on demand"""
+        key = (width, quality)
+        with self.variants_lock:
+            variant = self.variants.get(key)
+            if variant is None:
+                variant = StreamVariant(self, width, quality)
+                self.variants[key] = variant
+        variant.ensure_running()
+        return variant
+
+    def stop(self):
+        logger.info("Cleaning up camera resources...")
+        with self.demand_changed:
+            self.running = False
+            self.demand_changed.notify_all()
+        self.stop_event.set()
+        self.hub.close()
+        with self.consumers_lock:
+            for consumer in self.consumers:
+                consumer.close()
+        self._kill_process()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+class StreamVariant:
+    """Resized, re-encoded copy of the camera stream.
+
+    One worker per (width, quality) decodes the newest frame, scales it and
+    re-encodes it into the variant's own FrameHub, so the cost is paid once
+    per variant regardless of how many clients watch it. The worker only runs
+    while the hub has subscribers and stops after a short linger.
+    """
+
+    def __init__(self, camera, width, quality, linger=2.0):
+        if cv2 is None:
+            raise RuntimeError("OpenCV is required for stream variants")
+        self.camera = camera
+        self.width = width
+        self.quality = quality
+        self.linger = linger
+        self.hub = FrameHub()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.idle_since = time.time()
+
+    def ensure_running(self):
+        with self.lock:
+            # Counts as use, so the worker waits for the caller to subscribe
+            self.idle_since = time.time()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _decode_flag(self):
+        # Let libjpeg do most of the downscaling during decode when possible
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                             (4, cv2.IMREAD_REDUCED_COLOR_4),
+                             (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if self.camera.width // factor >= self.width:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def transcode(self, data):
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), self._decode_flag())
+        if image is None:
+            return None
+        height, width = image.shape[:2]
+        if width != self.width:
+            image = cv2.resize(image, (self.width, max(1, round(height * self.width / width))),
+                               interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return encoded.tobytes() if ok else None
+
+    def _run(self):
+        name = f"variant-{self.width}-q{self.quality}"
+        consumer = self.camera.subscribe(name, policy='latest', decodes=True)
+        try:
+            while not self.camera.hub.closed:
+                with self.lock:
+                    if self.hub.subscribers:
+                        self.idle_since = time.time()
+                    elif time.time() - self.idle_since > self.linger:
+                        # Decided under the lock, so ensure_running() either
+                        # kept this worker alive or will start a new one
+                        self.thread = None
+                        break
+
+                frame = consumer.get(timeout=0.5)
+                if frame is None:
+                    continue
+                data = self.transcode(frame.data)
+                if data:
+                    self.hub.publish(data, frame.timestamp)
+        except Exception as e:
+            logger.error(f"Error in {name}: {str(e)}")
+        finally:
+            self.camera.unsubscribe(consumer)
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
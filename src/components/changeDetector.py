@@ -0,0 +1,91 @@
+import time
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # Without OpenCV every frame counts as changed
+    cv2 = None
+    np = None
+
+
+class ChangeDetector:
+    """Decides whether a JPEG differs enough from the last accepted one.
+
+    Frames are decoded at 1/8 scale straight to grayscale (libjpeg skips most
+    of the work), shrunk to a fixed thumbnail and compared with the last
+    accepted thumbnail in one vectorized pass. Each thumbnail has its mean
+    removed, so auto-exposure changes do not count as scene changes.
+
+    sensitivity    fraction of thumbnail pixels that must change (lower = more uploads)
+    pixel_delta    gray-level difference at which a pixel counts as changed
+    min_interval   never accept frames closer together than this (seconds)
+    max_interval   accept a frame at least this often even without change (None = never)
+
+    should_upload() only picks a candidate; call accept() once the frame was
+    actually queued, so a failed upload does not become the reference.
+    """
+
+    def __init__(self, sensitivity=0.02, pixel_delta=25, min_interval=3.0, max_interval=60.0,
+                 size=(64, 48)):
+        self.sensitivity = sensitivity
+        self.pixel_delta = pixel_delta
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.size = size
+        self.reference = None
+        self.last_accepted = None
+        self.candidate = None
+        self.last_score = None
+        self.checked = 0
+        self.skipped = 0
+
+    def thumbnail(self, jpeg):
+        image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if image is None:
+            return None
+        image = cv2.resize(image, self.size, interpolation=cv2.INTER_AREA).astype(np.int16)
+        return image - int(image.mean())
+
+    def score(self, thumb):
+        """Fraction of pixels that changed against the reference"""
+        changed = np.count_nonzero(np.abs(thumb - self.reference) > self.pixel_delta)
+        return changed / thumb.size
+
+    def should_upload(self, jpeg, timestamp=None):
+        now = time.time() if timestamp is None else timestamp
+        if self.last_accepted is not None and now - self.last_accepted < self.min_interval:
+            return False
+
+        self.checked += 1
+        self.candidate = None
+        if cv2 is None:
+            self.candidate = (None, now)
+            return True
+
+        thumb = self.thumbnail(jpeg)
+        if thumb is None:
+            self.skipped += 1
+            return False
+
+        changed = self.reference is None
+        if not changed:
+            self.last_score = self.score(thumb)
+            changed = self.last_score >= self.sensitivity
+        overdue = (self.max_interval is not None and self.last_accepted is not None and
+                   now - self.last_accepted >= self.max_interval)
+        if not (changed or overdue):
+            self.skipped += 1
+            return False
+
+        self.candidate = (thumb, now)
+        return True
+
+    def accept(self):
+        """Make the frame should_upload() last approved the reference"""
+        if self.candidate is None:
+            return
+        thumb, self.last_accepted = self.candidate
+        self.candidate = None
+        if thumb is not None:
+            # Later frames are compared with this one, so slow drift still adds up
+            self.reference = thumb
@@ -9,6 +9,13 @@ import socket
 import threading
 import socketio  # New import for Socket.IO client
 import json  # For serializing data
+import os
+import numpy as np
+from missionGeometry import (simplify_waypoints, simplify_path, project_to_local, haversine,
+                             leg_distances, polygon_to_arrays, points_in_polygon)
+from noFlyZones import ZoneIndex
+from alertEngine import AlertEngine
+from batteryEstimator import BatteryEstimator
 
 # Create a Socket.IO client
 sio = socketio.Client(reconnection=True, reconnection_attempts=10,
@@ -17,6 +24,25 @@ sio = socketio.Client(reconnection=True, reconnection_attempts=10,
 # Define the relay server URL
 RELAY_SERVER_URL = 'http://128.199.26.169:3000'
 
+# Maximum number of waypoints the autopilot accepts in one mission
+MAX_MISSION_WAYPOINTS = 100
+
+# Route and energy limits used during mission validation
+MAX_DISTANCE_FROM_HOME = 1000  # meters, settings['maxDistanceFromHome'] may lower it
+FULL_BATTERY_FLIGHT_TIME = 20 * 60  # seconds of flight on a full battery
+BATTERY_RESERVE_PERCENT = 20  # percent kept in reserve for landing
+WAYPOINT_HOLD_TIME = 2.0  # seconds, matches the hold time sent in upload_mission
+
+# GeoJSON file or directory of files with no-fly / restricted-area polygons
+NO_FLY_ZONES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zones')
+
+# Alert thresholds
+ALTITUDE_CEILING = 120  # meters above home
+HEARTBEAT_GAP_ALERT = 3  # seconds without a heartbeat
+RETURN_SPEED = 5.0  # m/s assumed for return-to-home when no mission speed is known
+# Let alert rules switch flight mode (LOITER/RTL) on their own
+ALERT_AUTO_ACTIONS = False
+
 app = Flask(__name__)
 CORS(app, resources={
     r"/*": {
@@ -28,10 +54,11 @@ CORS(app, resources={
 
 class MissionError(Exception):
     """Custom exception for mission-related errors"""
-    def __init__(self, message, error_type, resolution=None):
+    def __init__(self, message, error_type, resolution=None, waypoint_indices=None):
         self.message = message
         self.error_type = error_type
         self.resolution = resolution
+        self.waypoint_indices = waypoint_indices or []
         super().__init__(self.message)
 
 class PixhawkConnection:
@@ -47,7 +74,7 @@ class PixhawkConnection:
         self.relative_alt = 0
         self.heading = 0
         self.groundspeed = 0
-        self.battery_percentage = 0
+        self.battery_percentage = -1  # Unknown until the first SYS_STATUS
         self.mode = "UNKNOWN"
         self.battery_voltage = 0
         self.battery_current = 0
@@ -61,9 +88,19 @@ class PixhawkConnection:
         self.update_telemetry_thread = None
         self.stop_thread = Event()
         self.mission_in_progress = False
+        self.mission_estimate = None
+        self.home_lat = None
+        self.home_lon = None
+        self.no_fly_zones = ZoneIndex()
+        self.current_zones = []
+        self.current_waypoint = 0
+        self.mission_route = None
+        self.battery_estimator = BatteryEstimator(reserve_percent=BATTERY_RESERVE_PERCENT)
         self.relay_connected = False
         self.telemetry_interval = None
         self.log_sync_interval = None
+        self.load_no_fly_zones()
+        self.alerts = AlertEngine(self.build_alert_rules(), self.handle_alert)
 
     def add_log(self, message, log_type='info', details=None):
         with self.logs_lock:
@@ -147,6 +184,177 @@ class PixhawkConnection:
                 finally:
                     self.connection = None
 
+    def load_no_fly_zones(self, path=NO_FLY_ZONES_PATH):
+        """Load no-fly zone polygons into the spatial index"""
+        if not os.path.exists(path):
+            return 0
+        try:
+            loaded = self.no_fly_zones.load_geojson(path)
+            self.add_log(f"Loaded {loaded} no-fly zones from {path}", "info")
+            return loaded
+        except Exception as e:
+            self.add_log(f"Failed to load no-fly zones: {str(e)}", "error")
+            return 0
+
+    def check_no_fly_zones(self):
+        """Log entering and leaving no-fly zones at the current position"""
+        names = [zone['name'] for zone in self.no_fly_zones.zones_at(self.lat, self.lon)]
+        if names == self.current_zones:
+            return
+        for name in names:
+            if name not in self.current_zones:
+                self.add_log(f"Entered no-fly zone: {name}", "error")
+        for name in self.current_zones:
+            if name not in names:
+                self.add_log(f"Left no-fly zone: {name}", "info")
+        self.current_zones = names
+
+    def build_alert_rules(self):
+        """Alert rule definitions, compiled once by the AlertEngine"""
+        # Flight-only rules report no value on the ground, e.g. on the bench with a flat battery
+        return [
+            {
+                'name': 'altitude_ceiling',
+                'metric': lambda: self.relative_alt,
+                'trigger': ALTITUDE_CEILING, 'clear': ALTITUDE_CEILING - 5,
+                'debounce': 1.0, 'severity': 'warning', 'action': 'LOITER',
+                'message': "Altitude {value:.0f}m above ceiling of {trigger}m",
+                'inputs': ['GLOBAL_POSITION_INT']
+            },
+            {
+                'name': 'distance_from_home',
+                'metric': lambda: self.distance_to_home() if self.armed else None,
+                'trigger': MAX_DISTANCE_FROM_HOME, 'clear': MAX_DISTANCE_FROM_HOME * 0.95,
+                'debounce': 1.0, 'severity': 'warning', 'action': 'RTL',
+                'message': "{value:.0f}m from home exceeds limit of {trigger}m",
+                'inputs': ['GLOBAL_POSITION_INT', 'HOME_POSITION', 'HEARTBEAT']
+            },
+            {
+                'name': 'geofence_breach',
+                'metric': lambda: len(self.current_zones),
+                'trigger': 1, 'clear': 0,
+                'debounce': 0.5, 'severity': 'error', 'action': 'RTL',
+                'message': "Inside {value} no-fly zone(s)",
+                'inputs': ['GLOBAL_POSITION_INT']
+            },
+            {
+                'name': 'battery_low',
+                'metric': lambda: self.battery_percentage if self.battery_percentage >= 0 else None,
+                'trigger': 20, 'clear': 25, 'above': False,
+                'debounce': 2.0, 'severity': 'warning',
+                'message': "Low battery warning: {value}%",
+                'inputs': ['SYS_STATUS']
+            },
+            {
+                'name': 'battery_critical',
+                'metric': lambda: self.battery_percentage if self.armed and self.battery_percentage >= 0 else None,
+                'trigger': 10, 'clear': 15, 'above': False,
+                'debounce': 2.0, 'severity': 'error', 'action': 'RTL',
+                'message': "Critical battery level: {value}%",
+                'inputs': ['SYS_STATUS', 'HEARTBEAT']
+            },
+            {
+                'name': 'battery_vs_route',
+                'metric': lambda: self.route_battery_margin() if self.armed else None,
+                'trigger': 0, 'clear': 60, 'above': False,
+                'debounce': 3.0, 'severity': 'error', 'action': 'RTL',
+                'message': "Battery margin for remaining route is {value:.0f}s",
+                'inputs': ['SYS_STATUS', 'GLOBAL_POSITION_INT', 'MISSION_CURRENT', 'HEARTBEAT']
+            },
+            {
+                'name': 'gps_fix_drop',
+                'metric': lambda: self.gps_fix_type if self.connected and self.armed else None,
+                'trigger': 2, 'clear': 3, 'above': False,
+                'debounce': 2.0, 'severity': 'error',
+                'message': "GPS fix dropped to type {value}",
+                'inputs': ['GPS_RAW_INT', 'HEARTBEAT']
+            },
+            {
+                'name': 'heartbeat_gap',
+                'metric': lambda: time.time() - self.last_heartbeat if self.connected else None,
+                'trigger': HEARTBEAT_GAP_ALERT, 'clear': 1,
+                'severity': 'error',
+                'message': "No heartbeat for {value:.1f}s",
+                'inputs': None
+            }
+        ]
+
+    def handle_alert(self, alert):
+        """Send an alert state change to the logs, the relay and, while armed, optionally the autopilot"""
+        self.add_log(alert['message'], alert['severity'], alert)
+
+        if self.relay_connected:
+            try:
+                sio.emit('alert', alert)
+            except Exception as e:
+                print(f"Failed to send alert to relay: {str(e)}")
+
+        action = alert['action']
+        if ALERT_AUTO_ACTIONS and action and self.armed and self.mode != action:
+            self.add_log(f"Alert {alert['rule']}: switching to {action}", "warning")
+            # set_mode waits for the heartbeat that this thread would deliver
+            Thread(target=self.set_mode, args=(action,), daemon=True).start()
+
+    def distance_to_home(self):
+        """Distance in meters from the current position to home"""
+        home = self.get_home()
+        if not home or self.gps_fix_type < 3:
+            return None
+        return float(haversine(home[0], home[1], self.lat, self.lon))
+
+    def remaining_route_time(self):
+        """Seconds needed to fly the rest of the mission (or straight home) and land at home"""
+        distance_home = self.distance_to_home()
+        if distance_home is None:
+            return None
+        route = self.mission_route
+        if not self.mission_in_progress or not route:
+            return distance_home / (route['speed'] if route else RETURN_SPEED)
+
+        wp = min(self.current_waypoint, len(route['lats']) - 1)
+        remaining = float(haversine(self.lat, self.lon, route['lats'][wp], route['lons'][wp]))
+        remaining += route['cumulative'][-1] - route['cumulative'][wp]
+        if route['return_home']:
+            remaining += route['home_distance']
+        return remaining / route['speed'] + WAYPOINT_HOLD_TIME * (len(route['lats']) - wp)
+
+    def available_flight_time(self):
+        """Seconds of flight left above the battery reserve"""
+        # The fitted discharge rate only reflects flight once airborne
+        if self.armed and self.relative_alt > 2:
+            tte = self.battery_estimator.time_to_empty()
+            if tte is not None:
+                return tte
+        if self.battery_percentage < 0:
+            return None
+        return (self.battery_percentage - BATTERY_RESERVE_PERCENT) / 100.0 * FULL_BATTERY_FLIGHT_TIME
+
+    def rtl_margin(self):
+        """Spare flight time after flying straight home at the current groundspeed"""
+        available = self.available_flight_time()
+        distance_home = self.distance_to_home()
+        if available is None or distance_home is None:
+            return None
+        speed = self.groundspeed if self.groundspeed > 1 else RETURN_SPEED
+        return available - distance_home / speed
+
+    def battery_status(self):
+        """Battery predictions exposed with telemetry"""
+        tte = self.battery_estimator.time_to_empty()
+        margin = self.rtl_margin()
+        return {
+            'tte_s': round(tte, 1) if tte is not None else None,
+            'rtl_margin_s': round(margin, 1) if margin is not None else None
+        }
+
+    def route_battery_margin(self):
+        """Spare flight time after finishing the remaining route, negative when short"""
+        needed = self.remaining_route_time()
+        available = self.available_flight_time()
+        if needed is None or available is None:
+            return None
+        return available - needed
+
     def request_data_streams(self):
         try:
             print("Requesting data streams...")
@@ -157,6 +365,13 @@ class PixhawkConnection:
                 4,  # 4 Hz update rate
                 1
             )
+            # Home position is not part of the regular streams, ask for it once
+            self.connection.mav.command_long_send(
+                self.connection.target_system,
+                self.connection.target_component,
+                mavutil.mavlink.MAV_CMD_GET_HOME_POSITION,
+                0, 0, 0, 0, 0, 0, 0, 0
+            )
             self.add_log("Data streams requested", "info")
         except Exception as e:
             self.add_log(f"Failed to request data streams: {str(e)}", "error")
@@ -165,11 +380,13 @@ class PixhawkConnection:
         while not self.stop_thread.is_set():
             try:
                 if not self.check_connection_health():
+                    self.alerts.update()
                     time.sleep(1)
                     continue
 
                 msg = self.connection.recv_match(blocking=True, timeout=1.0)
                 if msg is None:
+                    self.alerts.update()
                     continue
 
                 msg_type = msg.get_type()
@@ -192,6 +409,12 @@ class PixhawkConnection:
                     self.alt = msg.alt / 1000
                     self.relative_alt = msg.relative_alt / 1000
                     self.heading = msg.hdg / 100.0
+                    if len(self.no_fly_zones):
+                        self.check_no_fly_zones()
+
+                elif msg_type == 'HOME_POSITION':
+                    self.home_lat = msg.latitude / 1e7
+                    self.home_lon = msg.longitude / 1e7
 
                 elif msg_type == 'VFR_HUD':
                     self.groundspeed = msg.groundspeed
@@ -205,16 +428,20 @@ class PixhawkConnection:
                     self.battery_voltage = msg.voltage_battery / 1000
                     self.battery_current = msg.current_battery / 100
                     self.battery_consumed = msg.battery_remaining
-
-                    if self.battery_percentage <= 20:
-                        self.add_log(f"Low battery warning: {self.battery_percentage}%", "warning")
-                    elif self.battery_percentage <= 10:
-                        self.add_log(f"Critical battery level: {self.battery_percentage}%", "error")
+                    self.battery_estimator.update(
+                        time.time(),
+                        msg.battery_remaining,
+                        self.battery_voltage,
+                        self.battery_current if msg.current_battery >= 0 else None
+                    )
 
                 elif msg_type == 'MISSION_CURRENT':
-                    if self.mission_in_progress:
+                    if self.mission_in_progress and msg.seq != self.current_waypoint:
+                        self.current_waypoint = msg.seq
                         self.add_log(f"Current waypoint: {msg.seq}", "info")
 
+                self.alerts.update(msg_type)
+
             except Exception as e:
                 with self.connection_lock:
                     self.connected = False
@@ -249,7 +476,9 @@ class PixhawkConnection:
                         'armed': self.armed,
                         'gps_fix_type': self.gps_fix_type,
                         'satellites_visible': self.satellites_visible,
-                        'mission_in_progress': self.mission_in_progress
+                        'mission_in_progress': self.mission_in_progress,
+                        'no_fly_zones': self.current_zones,
+                        'battery': self.battery_status()
                     }
                     sio.emit('telemetry', telemetry_data)
                 except Exception as e:
@@ -303,6 +532,14 @@ class PixhawkConnection:
             if self.log_sync_interval:
                 self.log_sync_interval = None
 
+    def get_home(self):
+        """Home position reported by the autopilot, or the current position with a 3D fix"""
+        if self.home_lat is not None and self.home_lon is not None:
+            return self.home_lat, self.home_lon
+        if self.gps_fix_type >= 3:
+            return self.lat, self.lon
+        return None
+
     def check_mission_prerequisites(self):
         """Check all prerequisites before starting a mission"""
         try:
@@ -334,13 +571,28 @@ class PixhawkConnection:
                     "Switch to GUIDED mode before starting the mission."
                 )
 
-            if self.battery_percentage < 30:
+            available = self.available_flight_time()
+            if available is None:
+                raise MissionError(
+                    "Battery level unknown",
+                    "BATTERY_ERROR",
+                    "Wait for battery telemetry before starting the mission."
+                )
+            if available <= 0:
                 raise MissionError(
                     f"Low battery: {self.battery_percentage}%",
                     "BATTERY_ERROR",
                     "Charge or replace battery before starting mission."
                 )
 
+            needed = (self.mission_estimate or {}).get('flight_time')
+            if needed is not None and needed > available:
+                raise MissionError(
+                    f"Mission needs ~{needed / 60:.1f} min, battery allows ~{available / 60:.1f} min",
+                    "BATTERY_ERROR",
+                    "Shorten the route or charge/replace the battery before starting mission."
+                )
+
             if self.mission_in_progress:
                 raise MissionError(
                     "Mission already in progress",
@@ -373,27 +625,43 @@ class PixhawkConnection:
                     "Add at least one waypoint to the mission."
                 )
 
-            if len(waypoints) > 100:
+            # Dense paths may still fit once simplified, so defer the count check
+            if len(waypoints) > MAX_MISSION_WAYPOINTS and not (settings or {}).get('simplifyTolerance'):
                 raise MissionError(
                     "Too many waypoints",
                     "WAYPOINT_ERROR",
-                    "Reduce number of waypoints (maximum 100)."
+                    f"Reduce number of waypoints (maximum {MAX_MISSION_WAYPOINTS}) or set a simplification tolerance."
                 )
 
-            for i, wp in enumerate(waypoints):
-                if not all(k in wp for k in ['lat', 'lon', 'alt']):
-                    raise MissionError(
-                        f"Invalid waypoint at position {i+1}",
-                        "WAYPOINT_ERROR",
-                        "Ensure all waypoints have latitude, longitude, and altitude."
-                    )
+            invalid = [i for i, wp in enumerate(waypoints)
+                       if not all(k in wp for k in ['lat', 'lon', 'alt'])]
+            if invalid:
+                raise MissionError(
+                    f"Invalid waypoint at position {invalid[0]+1}",
+                    "WAYPOINT_ERROR",
+                    "Ensure all waypoints have latitude, longitude, and altitude.",
+                    invalid
+                )
 
-                if not (-90 <= wp['lat'] <= 90) or not (-180 <= wp['lon'] <= 180):
-                    raise MissionError(
-                        f"Invalid coordinates at waypoint {i+1}",
-                        "COORDINATE_ERROR",
-                        "Ensure coordinates are within valid ranges."
-                    )
+            try:
+                coords = np.array([(wp['lat'], wp['lon']) for wp in waypoints], dtype=np.float64)
+            except (TypeError, ValueError):
+                raise MissionError(
+                    "Non-numeric waypoint coordinates",
+                    "COORDINATE_ERROR",
+                    "Ensure coordinates are numbers."
+                )
+            lats, lons = coords[:, 0], coords[:, 1]
+
+            invalid = np.flatnonzero(~(np.isfinite(lats) & np.isfinite(lons) &
+                                       (np.abs(lats) <= 90) & (np.abs(lons) <= 180)))
+            if invalid.size:
+                raise MissionError(
+                    f"Invalid coordinates at waypoint {invalid[0]+1}",
+                    "COORDINATE_ERROR",
+                    "Ensure coordinates are within valid ranges.",
+                    invalid.tolist()
+                )
 
             if not settings:
                 raise MissionError(
@@ -425,13 +693,111 @@ class PixhawkConnection:
                     "Set speed between 0 and 15 m/s."
                 )
 
+            max_distance = settings.get('maxDistanceFromHome', MAX_DISTANCE_FROM_HOME)
+            if isinstance(max_distance, bool) or not isinstance(max_distance, (int, float)) or \
+                    not (0 < max_distance <= MAX_DISTANCE_FROM_HOME):
+                raise MissionError(
+                    f"Invalid maximum distance from home: {max_distance}m",
+                    "DISTANCE_ERROR",
+                    f"Set maxDistanceFromHome between 0 and {MAX_DISTANCE_FROM_HOME} meters."
+                )
+
+            # Every waypoint must lie inside at least one of the geofence polygons
+            geofence = settings.get('geofence') or []
+            if geofence:
+                inside = np.zeros(len(waypoints), dtype=bool)
+                for polygon in geofence:
+                    poly_lats, poly_lons = polygon_to_arrays(polygon)
+                    inside |= points_in_polygon(lats, lons, poly_lats, poly_lons)
+                outside = np.flatnonzero(~inside)
+                if outside.size:
+                    raise MissionError(
+                        f"{outside.size} waypoint(s) outside the geofence, first at waypoint {outside[0]+1}",
+                        "GEOFENCE_ERROR",
+                        "Move the highlighted waypoints inside the geofence.",
+                        outside.tolist()
+                    )
+
+            route_length = float(leg_distances(lats, lons).sum()) if len(waypoints) > 1 else 0.0
+
+            home = self.get_home()
+
+            # Check every leg, including the legs from and back to home, against no-fly zones
+            if len(self.no_fly_zones):
+                route_lats, route_lons = lats, lons
+                offset = 0
+                if home:
+                    route_lats = np.concatenate(([home[0]], route_lats))
+                    route_lons = np.concatenate(([home[1]], route_lons))
+                    offset = 1
+                    if settings['returnToHome']:
+                        route_lats = np.append(route_lats, home[0])
+                        route_lons = np.append(route_lons, home[1])
+                hits = self.no_fly_zones.route_hits(route_lats, route_lons)
+                if hits:
+                    # A leg's waypoints are its endpoints, excluding home
+                    indices = sorted({i for leg, _ in hits for i in (leg - offset, leg + 1 - offset)
+                                      if 0 <= i < len(waypoints)})
+                    names = sorted({zone['name'] for _, zone in hits})
+                    raise MissionError(
+                        f"Route crosses no-fly zone(s): {', '.join(names)}",
+                        "NO_FLY_ZONE_ERROR",
+                        "Move the highlighted waypoints so no leg enters a restricted area.",
+                        indices
+                    )
+
+            if home:
+                home_distances = haversine(home[0], home[1], lats, lons)
+                too_far = np.flatnonzero(home_distances > max_distance)
+                if too_far.size:
+                    raise MissionError(
+                        f"Waypoint {too_far[0]+1} is {home_distances[too_far[0]]:.0f}m from home",
+                        "DISTANCE_ERROR",
+                        f"Keep all waypoints within {max_distance}m of home.",
+                        too_far.tolist()
+                    )
+                route_length += float(home_distances[0])
+                if settings['returnToHome']:
+                    route_length += float(home_distances[-1])
+
+            # Hold time is spent only at the waypoints that survive simplification
+            upload_count = len(waypoints)
+            tolerance = float(settings.get('simplifyTolerance') or 0)
+            if tolerance > 0 and len(waypoints) > 2:
+                x, y = project_to_local(lats, lons)
+                upload_count = int(np.count_nonzero(simplify_path(x, y, tolerance)[0]))
+
+            # Estimate flight time and the battery it costs
+            flight_time = route_length / settings['speed'] + WAYPOINT_HOLD_TIME * upload_count
+            battery_required = 100.0 * flight_time / FULL_BATTERY_FLIGHT_TIME
+            available = self.available_flight_time()
+            self.mission_estimate = {
+                'route_length': round(route_length, 1),
+                'flight_time': round(flight_time, 1),
+                'battery_required': round(battery_required, 1)
+            }
+            # Without battery telemetry yet, start_mission checks again before takeoff
+            if available is not None and flight_time > available:
+                raise MissionError(
+                    f"Mission needs ~{flight_time / 60:.1f} min over {route_length:.0f}m, "
+                    f"battery allows ~{max(available, 0) / 60:.1f} min above reserve",
+                    "BATTERY_ERROR",
+                    "Shorten the route, increase speed, or replace the battery."
+                )
+
+            self.add_log(
+                f"Mission validated: {route_length:.0f}m, ~{flight_time / 60:.1f} min",
+                "info",
+                self.mission_estimate
+            )
             return True, None
 
         except MissionError as e:
             return False, {
                 'message': e.message,
                 'type': e.error_type,
-                'resolution': e.resolution
+                'resolution': e.resolution,
+                'waypoint_indices': e.waypoint_indices
             }
         except Exception as e:
             return False, {
@@ -440,6 +806,48 @@ class PixhawkConnection:
                 'resolution': "Contact support if problem persists."
             }
 
+    def simplify_mission(self, waypoints, settings):
+        """Optionally drop redundant waypoints before upload (settings['simplifyTolerance'] in meters)"""
+        try:
+            tolerance = float(settings.get('simplifyTolerance') or 0)
+            if tolerance < 0:
+                raise MissionError(
+                    f"Invalid simplification tolerance: {tolerance}m",
+                    "SETTINGS_ERROR",
+                    "Set a tolerance of 0 (disabled) or more meters."
+                )
+
+            if tolerance > 0:
+                waypoints, stats = simplify_waypoints(waypoints, tolerance)
+                self.add_log(
+                    f"Simplified mission: removed {stats['removed']} of {stats['original']} waypoints "
+                    f"(max deviation {stats['max_deviation']}m)",
+                    "info",
+                    stats
+                )
+
+            if len(waypoints) > MAX_MISSION_WAYPOINTS:
+                raise MissionError(
+                    f"Too many waypoints after simplification: {len(waypoints)}",
+                    "WAYPOINT_ERROR",
+                    f"Increase the simplification tolerance or reduce waypoints (maximum {MAX_MISSION_WAYPOINTS})."
+                )
+
+            return waypoints, None
+
+        except MissionError as e:
+            return None, {
+                'message': e.message,
+                'type': e.error_type,
+                'resolution': e.resolution
+            }
+        except Exception as e:
+            return None, {
+                'message': f"Unexpected error: {str(e)}",
+                'type': 'UNKNOWN_ERROR',
+                'resolution': "Contact support if problem persists."
+            }
+
     def upload_mission(self, waypoints, settings):
         """Upload a mission to the vehicle following proper MAVLink protocol"""
         try:
@@ -529,6 +937,7 @@ class PixhawkConnection:
                     "Try uploading the mission again."
                 )
 
+            self.store_mission_route(waypoints, settings)
             return True
 
         except MissionError as e:
@@ -538,6 +947,21 @@ class PixhawkConnection:
             self.add_log(f"Unexpected error during mission upload: {str(e)}", "error")
             return False
 
+    def store_mission_route(self, waypoints, settings):
+        """Keep the uploaded route with cumulative leg lengths for remaining-route estimates"""
+        lats = np.array([wp['lat'] for wp in waypoints], dtype=np.float64)
+        lons = np.array([wp['lon'] for wp in waypoints], dtype=np.float64)
+        home = self.get_home()
+        self.mission_route = {
+            'lats': lats,
+            'lons': lons,
+            'cumulative': np.concatenate(([0.0], np.cumsum(leg_distances(lats, lons)))),
+            'home_distance': float(haversine(lats[-1], lons[-1], home[0], home[1])) if home else 0.0,
+            'return_home': bool(settings['returnToHome']),
+            'speed': float(settings['speed'])
+        }
+        self.current_waypoint = 0
+
     def start_mission(self):
         """Start the uploaded mission with validation"""
         try:
@@ -726,6 +1150,19 @@ def mission(data):
         # Validate mission parameters
         valid, error = pixhawk.validate_mission_parameters(waypoints, settings)
         if not valid:
+            sio.emit('command_response', {
+                'type': 'mission_start',
+                'success': False,
+                'error': error['message'],
+                'error_type': error['type'],
+                'resolution': error['resolution'],
+                'waypoint_indices': error.get('waypoint_indices', [])
+            })
+            return
+
+        # Drop redundant waypoints if a tolerance was requested
+        waypoints, error = pixhawk.simplify_mission(waypoints, settings)
+        if error:
             sio.emit('command_response', {
                 'type': 'mission_start',
                 'success': False,
@@ -862,7 +1299,9 @@ def get_telemetry():
         'armed': pixhawk.armed,
         'gps_fix_type': pixhawk.gps_fix_type,
         'satellites_visible': pixhawk.satellites_visible,
-        'mission_in_progress': pixhawk.mission_in_progress
+        'mission_in_progress': pixhawk.mission_in_progress,
+        'no_fly_zones': pixhawk.current_zones,
+        'battery': pixhawk.battery_status()
     })
 
 @app.route('/logs', methods=['GET'])
@@ -904,6 +1343,17 @@ def start_mission():
         # Validate mission parameters
         valid, error = pixhawk.validate_mission_parameters(waypoints, settings)
         if not valid:
+            return jsonify({
+                'success': False,
+                'error': error['message'],
+                'error_type': error['type'],
+                'resolution': error['resolution'],
+                'waypoint_indices': error.get('waypoint_indices', [])
+            })
+
+        # Drop redundant waypoints if a tolerance was requested
+        waypoints, error = pixhawk.simplify_mission(waypoints, settings)
+        if error:
             return jsonify({
                 'success': False,
                 'error': error['message'],
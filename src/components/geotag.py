@@ -0,0 +1,142 @@
+import collections
+import struct
+import threading
+from datetime import datetime, timezone
+
+# One GLOBAL_POSITION_INT sample, t is the local receive time (same clock as frame capture)
+Position = collections.namedtuple('Position', ['t', 'lat', 'lon', 'alt', 'heading'])
+
+# EXIF / TIFF tag types
+BYTE, ASCII, SHORT, LONG, RATIONAL = 1, 2, 3, 4, 5
+TYPE_SIZES = {BYTE: 1, ASCII: 1, SHORT: 2, LONG: 4, RATIONAL: 8}
+
+
+class PositionHistory:
+    """Short ring buffer of vehicle positions for looking up where a frame was taken"""
+
+    def __init__(self, maxlen=256, max_gap=2.0):
+        self.samples = collections.deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+        # Do not interpolate across, or extrapolate beyond, gaps longer than this
+        self.max_gap = max_gap
+
+    def add(self, t, lat, lon, alt, heading):
+        with self.lock:
+            if self.samples and t <= self.samples[-1].t:
+                return
+            self.samples.append(Position(t, lat, lon, alt, heading))
+
+    def at(self, t):
+        """Position interpolated at time t, or None when no sample is close enough"""
+        with self.lock:
+            # Frames are tagged close to real time, so scan back from the newest sample
+            after = None
+            for sample in reversed(self.samples):
+                if sample.t <= t:
+                    before = sample
+                    break
+                after = sample
+            else:
+                before = None
+
+        if before is None:
+            return after if after is not None and after.t - t <= self.max_gap else None
+        if after is None or after.t - before.t > self.max_gap:
+            return before if t - before.t <= self.max_gap else None
+
+        f = (t - before.t) / (after.t - before.t)
+        turn = (after.heading - before.heading + 180.0) % 360.0 - 180.0
+        return Position(
+            t,
+            before.lat + (after.lat - before.lat) * f,
+            before.lon + (after.lon - before.lon) * f,
+            before.alt + (after.alt - before.alt) * f,
+            (before.heading + turn * f) % 360.0
+        )
+
+
+def _rational(value, denominator):
+    return (int(round(value * denominator)), denominator)
+
+
+def _dms(degrees, denominator=10000):
+    # Round once in whole 1/denominator seconds, so 59.99996" carries into the minutes
+    total = int(round(abs(degrees) * 3600 * denominator))
+    d, rest = divmod(total, 3600 * denominator)
+    m, s = divmod(rest, 60 * denominator)
+    return [(d, 1), (m, 1), (s, denominator)]
+
+
+def _pack_ifd(entries, offset):
+    """Big-endian IFD at the given TIFF offset; entries are (tag, type, values) sorted by tag"""
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    table = struct.pack('>H', len(entries))
+    extra = b''
+    for tag, kind, values in entries:
+        if kind == ASCII:
+            payload = values.encode('ascii') + b'\x00'
+            count = len(payload)
+        elif kind == RATIONAL:
+            payload = b''.join(struct.pack('>II', n, d) for n, d in values)
+            count = len(values)
+        else:
+            fmt = {BYTE: 'B', SHORT: 'H', LONG: 'I'}[kind]
+            payload = struct.pack('>' + fmt * len(values), *values)
+            count = len(values)
+
+        if len(payload) <= 4:
+            value_field = payload.ljust(4, b'\x00')
+        else:
+            value_field = struct.pack('>I', data_offset + len(extra))
+            extra += payload
+            if len(extra) % 2:
+                extra += b'\x00'
+        table += struct.pack('>HHI', tag, kind, count) + value_field
+    return table + struct.pack('>I', 0) + extra
+
+
+def exif_gps_segment(position):
+    """Complete APP1 Exif segment carrying the position as GPS tags"""
+    when = datetime.fromtimestamp(position.t, timezone.utc)
+    gps_entries = [
+        (0x0000, BYTE, [2, 3, 0, 0]),                                   # GPSVersionID
+        (0x0001, ASCII, 'N' if position.lat >= 0 else 'S'),             # GPSLatitudeRef
+        (0x0002, RATIONAL, _dms(position.lat)),                         # GPSLatitude
+        (0x0003, ASCII, 'E' if position.lon >= 0 else 'W'),             # GPSLongitudeRef
+        (0x0004, RATIONAL, _dms(position.lon)),                         # GPSLongitude
+        (0x0005, BYTE, [0 if position.alt >= 0 else 1]),                # GPSAltitudeRef
+        (0x0006, RATIONAL, [_rational(abs(position.alt), 100)]),        # GPSAltitude
+        (0x0007, RATIONAL, [(when.hour, 1), (when.minute, 1),           # GPSTimeStamp
+                            (when.second * 1000 + when.microsecond // 1000, 1000)]),
+        (0x0010, ASCII, 'T'),                                           # GPSImgDirectionRef
+        (0x0011, RATIONAL, [_rational(position.heading, 100)]),         # GPSImgDirection
+        (0x001d, ASCII, when.strftime('%Y:%m:%d')),                     # GPSDateStamp
+    ]
+    # TIFF header (8 bytes) + IFD0 with a single GPSInfo pointer (18 bytes)
+    gps_offset = 8 + 2 + 12 + 4
+    ifd0 = _pack_ifd([(0x8825, LONG, [gps_offset])], 8)
+    tiff = b'MM\x00\x2a' + struct.pack('>I', 8) + ifd0 + _pack_ifd(gps_entries, gps_offset)
+    body = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(body) + 2) + body
+
+
+def insert_segment(jpeg, segment):
+    """Insert an APP segment after SOI (and after a JFIF APP0), leaving the scan data untouched"""
+    position = 2
+    if jpeg[2:4] == b'\xff\xe0':
+        position = 4 + struct.unpack('>H', jpeg[4:6])[0]
+    return jpeg[:position] + segment + jpeg[position:]
+
+
+class Geotagger:
+    """Adds EXIF GPS tags for the capture time to JPEG frames without re-encoding them"""
+
+    def __init__(self, history):
+        self.history = history
+
+    def tag(self, jpeg, timestamp):
+        """(jpeg, position) with the GPS segment inserted, or the frame unchanged and None"""
+        position = self.history.at(timestamp)
+        if position is None or (position.lat == 0 and position.lon == 0):
+            return jpeg, None
+        return insert_segment(jpeg, exif_gps_segment(position)), position
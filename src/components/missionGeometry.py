@@ -0,0 +1,129 @@
+import numpy as np
+
+# Mean Earth radius used for all local projections and great-circle distances
+EARTH_RADIUS = 6371000.0
+
+
+def waypoints_to_arrays(waypoints):
+    """Convert a list of waypoint dicts into float64 lat/lon arrays"""
+    lats = np.fromiter((wp['lat'] for wp in waypoints), dtype=np.float64, count=len(waypoints))
+    lons = np.fromiter((wp['lon'] for wp in waypoints), dtype=np.float64, count=len(waypoints))
+    return lats, lons
+
+
+def project_to_local(lats, lons, origin_lat=None, origin_lon=None):
+    """Project lat/lon arrays to local east/north meters (equirectangular around the origin)"""
+    if origin_lat is None:
+        origin_lat = float(np.mean(lats))
+    if origin_lon is None:
+        origin_lon = float(np.mean(lons))
+    x = np.radians(lons - origin_lon) * EARTH_RADIUS * np.cos(np.radians(origin_lat))
+    y = np.radians(lats - origin_lat) * EARTH_RADIUS
+    return x, y
+
+
+def _segment_distances(x, y, first, last):
+    """Distance of every point strictly between first and last to the segment first-last"""
+    px = x[first + 1:last]
+    py = y[first + 1:last]
+    ax, ay = x[first], y[first]
+    dx, dy = x[last] - ax, y[last] - ay
+    seg_len_sq = dx * dx + dy * dy
+    if seg_len_sq == 0.0:
+        # Closed loop (start == end): fall back to plain point distance
+        return np.hypot(px - ax, py - ay)
+    t = np.clip(((px - ax) * dx + (py - ay) * dy) / seg_len_sq, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def simplify_path(x, y, tolerance):
+    """Iterative Ramer-Douglas-Peucker over projected points.
+
+    Returns a boolean keep-mask and the maximum deviation (meters) of any
+    dropped point from the simplified path.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep, 0.0
+    keep[0] = keep[-1] = True
+    max_deviation = 0.0
+
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        distances = _segment_distances(x, y, first, last)
+        idx = int(np.argmax(distances))
+        dmax = float(distances[idx])
+
+        if dmax > tolerance:
+            split = first + 1 + idx
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+        else:
+            # Every interior point of this span is dropped
+            max_deviation = max(max_deviation, dmax)
+
+    return keep, max_deviation
+
+
+def simplify_waypoints(waypoints, tolerance):
+    """Simplify a waypoint list with the given tolerance in meters.
+
+    Returns the kept waypoints (original dicts, original order) and a stats
+    dict with the number of removed points and the maximum deviation.
+    """
+    if len(waypoints) < 3 or tolerance <= 0:
+        return list(waypoints), {'original': len(waypoints), 'removed': 0, 'max_deviation': 0.0}
+
+    lats, lons = waypoints_to_arrays(waypoints)
+    x, y = project_to_local(lats, lons)
+    keep, max_deviation = simplify_path(x, y, tolerance)
+
+    simplified = [waypoints[i] for i in np.flatnonzero(keep)]
+    return simplified, {
+        'original': len(waypoints),
+        'removed': len(waypoints) - len(simplified),
+        'max_deviation': round(max_deviation, 2)
+    }
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in meters"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2.0) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def leg_distances(lats, lons):
+    """Distances in meters between consecutive points"""
+    return haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def polygon_to_arrays(polygon):
+    """Accept a polygon as [{'lat', 'lon'}, ...] or [[lat, lon], ...] and return lat/lon arrays"""
+    if polygon and isinstance(polygon[0], dict):
+        return waypoints_to_arrays(polygon)
+    coords = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    return coords[:, 0], coords[:, 1]
+
+
+def points_in_polygon(lats, lons, poly_lats, poly_lons):
+    """Even-odd ray casting of all points against all polygon edges at once"""
+    py = lats[:, None]
+    px = lons[:, None]
+    y1 = poly_lats[None, :]
+    x1 = poly_lons[None, :]
+    y2 = np.roll(poly_lats, -1)[None, :]
+    x2 = np.roll(poly_lons, -1)[None, :]
+
+    crosses = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_intersect = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    hits = crosses & (px < x_intersect)
+    return (np.count_nonzero(hits, axis=1) % 2) == 1
@@ -0,0 +1,196 @@
+import json
+import logging
+import math
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Kinds of area the index keeps the vehicle out of. Allowed areas (geofences)
+# are the opposite test and come with the mission settings instead.
+RESTRICTED_KINDS = ('no_fly', 'restricted')
+# Zones spanning more grid cells than this are checked on every query instead
+MAX_ZONE_CELLS = 1024
+
+
+class ZoneIndex:
+    """Uniform-grid spatial index over no-fly / restricted-area polygons.
+
+    Polygons are stored as flat edge arrays (all rings together, so holes work
+    through the even-odd rule) and bucketed by bounding box into grid cells of
+    cell_size degrees. Queries only touch the zones registered in the cells
+    they fall into. Zones larger than max_zone_cells cells (a whole region,
+    say) are kept in a short list that every query checks by bounding box.
+    """
+
+    def __init__(self, cell_size=0.02, max_zone_cells=MAX_ZONE_CELLS):
+        self.cell_size = cell_size
+        self.max_zone_cells = max_zone_cells
+        self.zones = []
+        self.grid = {}
+        self.large_zones = []
+
+    def __len__(self):
+        return len(self.zones)
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lon / self.cell_size)), int(math.floor(lat / self.cell_size)))
+
+    def add_zone(self, rings, name=None, kind='no_fly', properties=None):
+        """Add a polygon given as a list of rings of [lon, lat] pairs (outer ring first)"""
+        if kind not in RESTRICTED_KINDS:
+            raise ValueError(f"Unsupported zone kind: {kind}")
+        x1, y1, x2, y2 = [], [], [], []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(ring) < 3:
+                continue
+            if np.array_equal(ring[0], ring[-1]):
+                ring = ring[:-1]
+            nxt = np.roll(ring, -1, axis=0)
+            x1.append(ring[:, 0])
+            y1.append(ring[:, 1])
+            x2.append(nxt[:, 0])
+            y2.append(nxt[:, 1])
+        if not x1:
+            return None
+
+        zone_id = len(self.zones)
+        edges = tuple(np.concatenate(v) for v in (x1, y1, x2, y2))
+        min_lon = float(min(edges[0].min(), edges[2].min()))
+        max_lon = float(max(edges[0].max(), edges[2].max()))
+        min_lat = float(min(edges[1].min(), edges[3].min()))
+        max_lat = float(max(edges[1].max(), edges[3].max()))
+        self.zones.append({
+            'id': zone_id,
+            'name': name or f"zone-{zone_id}",
+            'kind': kind,
+            'properties': properties or {},
+            'bbox': (min_lon, min_lat, max_lon, max_lat),
+            'edges': edges
+        })
+
+        min_cx, min_cy = self._cell(min_lat, min_lon)
+        max_cx, max_cy = self._cell(max_lat, max_lon)
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > self.max_zone_cells:
+            self.large_zones.append(zone_id)
+            return zone_id
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                self.grid.setdefault((cx, cy), []).append(zone_id)
+        return zone_id
+
+    def load_geojson(self, path):
+        """Load Polygon/MultiPolygon features from a GeoJSON file or a directory of them"""
+        if os.path.isdir(path):
+            return sum(self.load_geojson(os.path.join(path, f))
+                       for f in sorted(os.listdir(path))
+                       if f.endswith(('.geojson', '.json')))
+
+        with open(path) as f:
+            data = json.load(f)
+
+        if data.get('type') == 'FeatureCollection':
+            features = data.get('features', [])
+        elif data.get('type') == 'Feature':
+            features = [data]
+        else:
+            features = [{'type': 'Feature', 'geometry': data, 'properties': {}}]
+
+        loaded = 0
+        for feature in features:
+            geometry = feature.get('geometry') or {}
+            properties = feature.get('properties') or {}
+            name = properties.get('name')
+            kind = properties.get('kind', 'no_fly')
+            if kind not in RESTRICTED_KINDS:
+                logger.warning(f"Skipping zone {name or '(unnamed)'} in {path}: kind '{kind}' is not "
+                               f"a restricted area ({', '.join(RESTRICTED_KINDS)})")
+                continue
+            if geometry.get('type') == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            for rings in polygons:
+                if self.add_zone(rings, name, kind, properties) is not None:
+                    loaded += 1
+        return loaded
+
+    def _candidates(self, min_lat, min_lon, max_lat, max_lon):
+        min_cx, min_cy = self._cell(min_lat, min_lon)
+        max_cx, max_cy = self._cell(max_lat, max_lon)
+        buckets = [self.large_zones]
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                buckets.append(self.grid.get((cx, cy), ()))
+        seen = set()
+        for bucket in buckets:
+            for zone_id in bucket:
+                if zone_id in seen:
+                    continue
+                seen.add(zone_id)
+                zone = self.zones[zone_id]
+                z_min_lon, z_min_lat, z_max_lon, z_max_lat = zone['bbox']
+                if (z_max_lon >= min_lon and z_min_lon <= max_lon and
+                        z_max_lat >= min_lat and z_min_lat <= max_lat):
+                    yield zone
+
+    @staticmethod
+    def _contains(zone, lat, lon):
+        x1, y1, x2, y2 = zone['edges']
+        crosses = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_intersect = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        return bool(np.count_nonzero(crosses & (lon < x_intersect)) % 2)
+
+    @staticmethod
+    def _crosses_edges(zone, lat1, lon1, lat2, lon2):
+        x1, y1, x2, y2 = zone['edges']
+        # Orientation tests of the segment against every edge at once
+        d1 = (x2 - x1) * (lat1 - y1) - (y2 - y1) * (lon1 - x1)
+        d2 = (x2 - x1) * (lat2 - y1) - (y2 - y1) * (lon2 - x1)
+        d3 = (lon2 - lon1) * (y1 - lat1) - (lat2 - lat1) * (x1 - lon1)
+        d4 = (lon2 - lon1) * (y2 - lat1) - (lat2 - lat1) * (x2 - lon1)
+        crossing = (d1 * d2 < 0) & (d3 * d4 < 0)
+        # A zero orientation only counts when that point lies within the other segment,
+        # so collinear but disjoint edges are not hits
+        touching = (((d1 == 0) & ZoneIndex._between(lon1, lat1, x1, y1, x2, y2)) |
+                    ((d2 == 0) & ZoneIndex._between(lon2, lat2, x1, y1, x2, y2)) |
+                    ((d3 == 0) & ZoneIndex._between(x1, y1, lon1, lat1, lon2, lat2)) |
+                    ((d4 == 0) & ZoneIndex._between(x2, y2, lon1, lat1, lon2, lat2)))
+        return bool(np.any(crossing | touching))
+
+    @staticmethod
+    def _between(px, py, ax, ay, bx, by):
+        """Whether the point lies in the bounding box of segment a-b (on it, if collinear)"""
+        return ((np.minimum(ax, bx) <= px) & (px <= np.maximum(ax, bx)) &
+                (np.minimum(ay, by) <= py) & (py <= np.maximum(ay, by)))
+
+    def zones_at(self, lat, lon):
+        """Zones containing the point"""
+        return [zone for zone in self._candidates(lat, lon, lat, lon)
+                if self._contains(zone, lat, lon)]
+
+    def segment_hits(self, lat1, lon1, lat2, lon2):
+        """Zones the straight segment touches (entering, crossing or lying inside)"""
+        hits = []
+        for zone in self._candidates(min(lat1, lat2), min(lon1, lon2),
+                                     max(lat1, lat2), max(lon1, lon2)):
+            if (self._contains(zone, lat1, lon1) or
+                    self._crosses_edges(zone, lat1, lon1, lat2, lon2)):
+                hits.append(zone)
+        return hits
+
+    def route_hits(self, lats, lons):
+        """(leg index, zone) pairs for every leg of the route that touches a zone"""
+        hits = []
+        if not self.zones:
+            return hits
+        for i in range(len(lats) - 1):
+            for zone in self.segment_hits(float(lats[i]), float(lons[i]),
+                                          float(lats[i + 1]), float(lons[i + 1])):
+                hits.append((i, zone))
+        return hits
@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+CPU_COUNT = os.cpu_count() or 1
+
+# Degradation levels, applied in order while telemetry ingest is falling behind
+NORMAL, DECODE_THROTTLED, REDUCED_FPS, REDUCED_RESOLUTION, ANALYTICS_PAUSED = range(5)
+LEVEL_NAMES = ['normal', 'decode_throttled', 'reduced_fps', 'reduced_resolution', 'analytics_paused']
+# Decoding consumers take every Nth frame from DECODE_THROTTLED on
+DECODE_EVERY = 2
+
+
+def _cpu_ticks(path):
+    """utime + stime from a /proc stat file"""
+    with open(path) as f:
+        # The command name may contain spaces, the fields after it do not
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[11]) + int(fields[12])
+
+
+class CpuSampler:
+    """Process and per-thread CPU use from /proc/self, as fractions of one core"""
+
+    def __init__(self):
+        self.last_time = None
+        self.last_process = 0
+        self.last_threads = {}
+
+    def sample(self):
+        now = time.monotonic()
+        process = _cpu_ticks('/proc/self/stat')
+        threads = {}
+        for tid in os.listdir('/proc/self/task'):
+            try:
+                threads[int(tid)] = _cpu_ticks(f'/proc/self/task/{tid}/stat')
+            except (OSError, IndexError, ValueError):
+                continue  # Thread exited while we looked
+
+        if self.last_time is None:
+            usage = None
+        else:
+            elapsed = (now - self.last_time) * CLOCK_TICKS
+            names = {t.native_id: t.name for t in threading.enumerate()}
+            usage = {
+                'process': (process - self.last_process) / elapsed,
+                'threads': {names.get(tid, str(tid)): (ticks - self.last_threads.get(tid, ticks)) / elapsed
+                            for tid, ticks in threads.items()}
+            }
+        self.last_time = now
+        self.last_process = process
+        self.last_threads = threads
+        return usage
+
+
+class ResourceGovernor:
+    """Sheds video work when the process runs out of CPU for telemetry.
+
+    Every interval it samples process and per-thread CPU from /proc/self and
+    the MAVLink ingest lag (seconds of telemetry waiting to be read). When
+    the lag exceeds lag_limit, or the process uses more than cpu_limit of
+    the machine, for degrade_after checks in a row, it steps one level down:
+    decode only every other frame in the consumers that decode (WebRTC
+    MJPEG track, stream variants), then half the camera frame rate, then
+    half the resolution as well, then the analytics (anything with
+    pause()/resume(), e.g. the snapshot uploader and its change detector)
+    paused. After recover_after healthy checks it steps back up one level.
+    Telemetry and command handling are never throttled.
+
+    A camera mode set by someone else (e.g. /camera/config) while degraded
+    becomes the new full-quality mode that recovery returns to.
+    """
+
+    def __init__(self, camera, ingest_lag, analytics=(), interval=1.0, lag_limit=0.25,
+                 cpu_limit=0.8, degrade_after=2, recover_after=15, min_framerate=5):
+        self.camera = camera
+        self.ingest_lag = ingest_lag
+        self.analytics = list(analytics)
+        self.interval = interval
+        self.lag_limit = lag_limit
+        self.cpu_limit = cpu_limit
+        self.degrade_after = degrade_after
+        self.recover_after = recover_after
+        self.min_framerate = min_framerate
+        self.sampler = CpuSampler()
+        self.level = NORMAL
+        self.base = None
+        # Camera mode the governor last set, to notice changes made by others
+        self.applied = None
+        self.overloaded_checks = 0
+        self.healthy_checks = 0
+        self.last_usage = None
+        self.last_lag = None
+        self.changes = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name='resource-governor', daemon=True)
+            self.thread.start()
+            logger.info(f"Resource governor started (lag limit {self.lag_limit}s, CPU limit {self.cpu_limit:.0%})")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Resource governor check failed: {str(e)}")
+
+    def check(self):
+        usage = self.sampler.sample()
+        lag = self.ingest_lag()
+        self.last_usage = usage
+        self.last_lag = lag
+        if usage is None:
+            return
+
+        current = (self.camera.width, self.camera.height, self.camera.framerate)
+        if self.level != NORMAL and current != self.applied:
+            logger.info(f"Camera set to {current[0]}x{current[1]}@{current[2]} outside the governor, "
+                        "recovering to that")
+            self.base = self.applied = current
+
+        overloaded = ((lag is not None and lag > self.lag_limit) or
+                      usage['process'] / CPU_COUNT > self.cpu_limit)
+        if overloaded:
+            self.overloaded_checks += 1
+            self.healthy_checks = 0
+            if self.overloaded_checks >= self.degrade_after and self.level < ANALYTICS_PAUSED:
+                self.overloaded_checks = 0
+                self.set_level(self.level + 1)
+        else:
+            self.healthy_checks += 1
+            self.overloaded_checks = 0
+            if self.healthy_checks >= self.recover_after and self.level > NORMAL:
+                self.healthy_checks = 0
+                self.set_level(self.level - 1)
+
+    def set_level(self, level):
+        current = (self.camera.width, self.camera.height, self.camera.framerate)
+        if self.level == NORMAL:
+            # Whatever the camera runs at when nothing is shed counts as full quality
+            self.base = current
+        width, height, framerate = self.base
+        if level >= REDUCED_FPS:
+            framerate = max(self.min_framerate, framerate // 2)
+        if level >= REDUCED_RESOLUTION:
+            width, height = width // 4 * 2, height // 4 * 2
+        if (width, height, framerate) != current:
+            self.camera.reconfigure(width, height, framerate)
+        self.applied = (width, height, framerate)
+
+        if (level >= DECODE_THROTTLED) != (self.level >= DECODE_THROTTLED):
+            self.camera.throttle_decoders(DECODE_EVERY if level >= DECODE_THROTTLED else 1)
+
+        if (level >= ANALYTICS_PAUSED) != (self.level >= ANALYTICS_PAUSED):
+            for analytic in self.analytics:
+                if level >= ANALYTICS_PAUSED:
+                    analytic.pause()
+                else:
+                    analytic.resume()
+
+        logger.warning(f"Resource governor: {LEVEL_NAMES[self.level]} -> {LEVEL_NAMES[level]} "
+                       f"(ingest lag {self.last_lag}, CPU {self.last_usage['process']:.0%})")
+        self.level = level
+        self.changes += 1
+
+    def status(self):
+        usage = self.last_usage or {'process': 0.0, 'threads': {}}
+        busiest = sorted(usage['threads'].items(), key=lambda item: item[1], reverse=True)[:5]
+        return {
+            'level': LEVEL_NAMES[self.level],
+            'changes': self.changes,
+            'ingest_lag': round(self.last_lag, 3) if self.last_lag is not None else None,
+            'process_cpu': round(usage['process'], 3),
+            'threads_cpu': {name: round(value, 3) for name, value in busiest}
+        }
@@ -1,15 +1,23 @@
 #!/usr/bin/python3
 from flask import Flask, jsonify, request, Response
+from werkzeug.datastructures import ContentRange
 from flask_cors import CORS
 from pymavlink import mavutil
 from threading import Thread, Lock, Event
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import socket
 import threading
-import subprocess
-import io
+import os
 import logging
+from cameraPipeline import CameraService, STARTUP_TIMEOUT
+from snapshotUploader import SnapshotUploader
+from uploadQueue import UploadQueue
+from resourceGovernor import ResourceGovernor
+from videoStats import stats
+from videoRecorder import VideoRecorder, read_pieces
+from geotag import PositionHistory, Geotagger
+from changeDetector import ChangeDetector
 
 app = Flask(__name__)
 CORS(app, resources={
@@ -24,6 +32,54 @@ CORS(app, resources={
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Camera settings shared by every consumer of the single capture
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+CAMERA_FRAMERATE = 40
+# libcamera-vid only runs while something uses the camera (stream clients,
+# WebRTC viewers, recorder, uploader) and stops this many seconds after the last leaves
+CAMERA_LINGER = float(os.environ.get('CAMERA_LINGER', '10'))
+# Limits for runtime reconfiguration through /camera/config (Pi camera v1 full sensor)
+CAMERA_MAX_WIDTH = 2592
+CAMERA_MAX_HEIGHT = 1944
+CAMERA_MAX_FRAMERATE = 90
+
+# Also serve WebRTC from this process, sharing the capture above
+ENABLE_WEBRTC = os.environ.get('ENABLE_WEBRTC', '0') == '1'
+
+# Surveillance frame uploads (0 disables the periodic uploader)
+UPLOAD_URL = 'http://128.199.26.169:3004/upload'
+SNAPSHOT_UPLOAD_INTERVAL = float(os.environ.get('SNAPSHOT_UPLOAD_INTERVAL', '3'))
+
+# Uploads are spooled to disk and sent in the background, surviving link
+# outages and restarts. UPLOAD_MODE=multipart batches several images per request
+UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_spool'))
+UPLOAD_SPOOL_MAX_MB = int(os.environ.get('UPLOAD_SPOOL_MAX_MB', '200'))
+UPLOAD_MODE = os.environ.get('UPLOAD_MODE', 'json')
+UPLOAD_WORKERS = 2
+
+# Only upload frames that differ from the last upload. SNAPSHOT_UPLOAD_INTERVAL
+# becomes the minimum gap between uploads and the scene is checked every
+# CHANGE_CHECK_INTERVAL; a frame is still sent every CHANGE_MAX_INTERVAL
+CHANGE_DETECTION = os.environ.get('CHANGE_DETECTION', '1') == '1'
+CHANGE_SENSITIVITY = float(os.environ.get('CHANGE_SENSITIVITY', '0.02'))
+CHANGE_CHECK_INTERVAL = 0.5
+CHANGE_MAX_INTERVAL = 60
+
+# On-board recording of the camera stream, in rotating segments. Off by
+# default: it writes to the SD card continuously and keeps the camera running
+ENABLE_RECORDING = os.environ.get('ENABLE_RECORDING', '0') == '1'
+RECORDING_DIR = os.environ.get('RECORDING_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings'))
+RECORDING_SEGMENT_SECONDS = 60
+RECORDING_MAX_MB = int(os.environ.get('RECORDING_MAX_MB', '2048'))
+
+# Shed video work (decode rate, frame rate, resolution, then analytics) when MAVLink
+# ingest falls more than GOVERNOR_LAG_LIMIT seconds behind or the process
+# uses more than GOVERNOR_CPU_LIMIT of the CPU
+ENABLE_GOVERNOR = os.environ.get('ENABLE_GOVERNOR', '1') == '1'
+GOVERNOR_LAG_LIMIT = float(os.environ.get('GOVERNOR_LAG_LIMIT', '0.25'))
+GOVERNOR_CPU_LIMIT = float(os.environ.get('GOVERNOR_CPU_LIMIT', '0.8'))
+
 class MissionError(Exception):
     """Custom exception for mission-related errors"""
     def __init__(self, message, error_type, resolution=None):
@@ -32,81 +88,6 @@ class MissionError(Exception):
         self.resolution = resolution
         super().__init__(self.message)
 
-class CameraStream:
-    def __init__(self):
-        self.frame = None
-        self.process = None
-        self.thread_running = False
-        self.thread = None
-
-    def start_capture(self):
-        if self.thread is None:
-            logger.info("Starting camera capture...")
-            self.thread_running = True
-            self.thread = threading.Thread(target=self._capture)
-            self.thread.start()
-
-    def _capture(self):
-        command = [
-            'libcamera-vid',
-            '-t', '0',           # Run indefinitely
-            '--inline',          # Output JPEG frames
-            '--width', '640',    # Set width to 640 (480p)
-            '--height', '480',   # Set height to 480
-            '--framerate', '40', # Higher framerate for stability
-            '--codec', 'mjpeg',  # Use MJPEG codec
-            '--output', '-'      # Output to stdout
-        ]
-
-        try:
-            self.process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            logger.info("Camera process started")
-
-            # Buffer for incomplete frames
-            buffer = io.BytesIO()
-
-            while self.thread_running:
-                # Read chunk from stdout
-                chunk = self.process.stdout.read(4096)
-                if not chunk:
-                    break
-
-                buffer.write(chunk)
-                buffer_str = buffer.getvalue()
-
-                # Look for JPEG start and end markers
-                start = buffer_str.find(b'\xff\xd8')
-                end = buffer_str.find(b'\xff\xd9')
-
-                if start != -1 and end != -1 and end > start:
-                    # Extract the complete JPEG frame
-                    self.frame = buffer_str[start:end + 2]
-                    # Keep the remainder
-                    buffer = io.BytesIO()
-                    buffer.write(buffer_str[end + 2:])
-
-        except Exception as e:
-            logger.error(f"Error in capture thread: {str(e)}")
-        finally:
-            if self.process:
-                self.process.terminate()
-                logger.info("Camera process terminated")
-
-    def get_frame(self):
-        return self.frame
-
-    def cleanup(self):
-        logger.info("Cleaning up camera resources...")
-        self.thread_running = False
-        if self.process:
-            self.process.terminate()
-        if self.thread:
-            self.thread.join()
-
 class PixhawkConnection:
     def __init__(self):
         self.connection = None
@@ -136,6 +117,8 @@ class PixhawkConnection:
         self.mission_in_progress = False
         self.total_waypoints = 0
         self.current_waypoint = 0
+        # Recent positions for tagging camera frames with where they were taken
+        self.positions = PositionHistory()
 
     def add_log(self, message, log_type='info', details=None):
         with self.logs_lock:
@@ -250,6 +233,7 @@ class PixhawkConnection:
                     self.alt = msg.alt / 1000
                     self.relative_alt = msg.relative_alt / 1000
                     self.heading = msg.hdg / 100.0
+                    self.positions.add(time.time(), self.lat, self.lon, self.alt, self.heading)
 
                 elif msg_type == 'VFR_HUD':
                     self.groundspeed = msg.groundspeed
@@ -682,6 +666,40 @@ class PixhawkConnection:
             print(error_msg)
             return False
 
+    def ingest_lag(self):
+        """Seconds of telemetry waiting in the serial buffer, None when not on a serial link"""
+        connection = self.connection
+        port = getattr(connection, 'port', None)
+        if not self.connected or not hasattr(port, 'in_waiting'):
+            return None
+        try:
+            # 10 bits per byte on the wire
+            return port.in_waiting * 10.0 / connection.baud
+        except (OSError, AttributeError):
+            return None
+
+    def telemetry_snapshot(self):
+        return {
+            'connected': self.check_connection_health(),
+            'lat': self.lat,
+            'lon': self.lon,
+            'alt': self.alt,
+            'relative_alt': self.relative_alt,
+            'heading': self.heading,
+            'groundspeed': self.groundspeed,
+            'battery_percentage': self.battery_percentage,
+            'mode': self.mode,
+            'battery_voltage': self.battery_voltage,
+            'battery_current': self.battery_current,
+            'battery_consumed': self.battery_consumed,
+            'armed': self.armed,
+            'gps_fix_type': self.gps_fix_type,
+            'satellites_visible': self.satellites_visible,
+            'mission_in_progress': self.mission_in_progress,
+            'current_waypoint': self.current_waypoint,
+            'total_waypoints': self.total_waypoints
+        }
+
     def clear_logs(self):
         with self.logs_lock:
             self.logs = []
@@ -689,15 +707,60 @@ class PixhawkConnection:
 
 # Initialize both Pixhawk and Camera
 pixhawk = PixhawkConnection()
-camera = CameraStream()
-
-def generate_frames():
-    while True:
-        frame = camera.get_frame()
-        if frame is not None:
+camera = CameraService(width=CAMERA_WIDTH, height=CAMERA_HEIGHT, framerate=CAMERA_FRAMERATE,
+                       linger=CAMERA_LINGER)
+geotagger = Geotagger(pixhawk.positions)
+
+
+def surveillance_active():
+    # Only wake the camera for uploads while the vehicle is in use; frames
+    # captured for anyone else (e.g. a viewer) are uploaded regardless
+    return bool(pixhawk.armed) or pixhawk.mission_in_progress
+
+
+upload_queue = UploadQueue(UPLOAD_URL, UPLOAD_SPOOL_DIR, mode=UPLOAD_MODE, workers=UPLOAD_WORKERS,
+                           max_bytes=UPLOAD_SPOOL_MAX_MB * 1024 * 1024)
+if CHANGE_DETECTION:
+    detector = ChangeDetector(sensitivity=CHANGE_SENSITIVITY, min_interval=SNAPSHOT_UPLOAD_INTERVAL,
+                              max_interval=CHANGE_MAX_INTERVAL)
+    uploader = SnapshotUploader(camera.hub, upload_queue, interval=CHANGE_CHECK_INTERVAL,
+                                geotagger=geotagger, detector=detector,
+                                camera=camera, active=surveillance_active)
+else:
+    uploader = SnapshotUploader(camera.hub, upload_queue, interval=SNAPSHOT_UPLOAD_INTERVAL,
+                                geotagger=geotagger, camera=camera, active=surveillance_active)
+governor = ResourceGovernor(camera, pixhawk.ingest_lag, analytics=[uploader],
+                            lag_limit=GOVERNOR_LAG_LIMIT, cpu_limit=GOVERNOR_CPU_LIMIT)
+recorder = VideoRecorder(camera, RECORDING_DIR, segment_seconds=RECORDING_SEGMENT_SECONDS,
+                         max_bytes=RECORDING_MAX_MB * 1024 * 1024,
+                         telemetry=pixhawk.telemetry_snapshot)
+
+def generate_frames(hub):
+    camera.acquire('stream')
+    viewers = hub.add_subscriber()
+    logger.info(f"Stream client connected ({viewers} watching)")
+    seq = 0
+    try:
+        while not camera.hub.closed:
+            # Wakes on the next new frame; slow clients skip to the newest one
+            new_seq, timestamp, frame = hub.wait_for_frame(seq, timeout=5)
+            if frame is None:
+                # No new frame, resend the last one so dead clients are noticed
+                new_seq, _, frame = hub.snapshot()
+                if frame is None:
+                    continue
+            seq = new_seq
             yield (b'--frame\r\n'
                    b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        time.sleep(0.025)  # ~40 fps
+            if timestamp is not None:
+                # The generator resumes once the server has written the chunk
+                stats.record('http_sent', timestamp)
+                stats.tick('http')
+    finally:
+        # Runs on client disconnect (GeneratorExit) as well as on shutdown
+        viewers = hub.remove_subscriber()
+        camera.release('stream')
+        logger.info(f"Stream client disconnected ({viewers} watching)")
 
 # API Routes
 @app.route('/health', methods=['GET'])
@@ -712,6 +775,7 @@ def health_check():
         'battery': pixhawk.battery_percentage,
         'mode': pixhawk.mode,
         'armed': pixhawk.armed,
+        'camera': camera.health(),
         'mission_status': {
             'in_progress': pixhawk.mission_in_progress,
             'current_waypoint': pixhawk.current_waypoint,
@@ -726,7 +790,8 @@ def connect():
         if success:
             if not pixhawk.update_telemetry_thread or not pixhawk.update_telemetry_thread.is_alive():
                 pixhawk.update_telemetry_thread = Thread(
-                    target=pixhawk.update_telemetry, 
+                    target=pixhawk.update_telemetry,
+                    name='mavlink-ingest',
                     daemon=True
                 )
                 pixhawk.update_telemetry_thread.start()
@@ -745,32 +810,196 @@ def disconnect():
 
 @app.route('/stream')
 def stream():
-    return Response(generate_frames(),
+    # Optional lower-bandwidth variant, e.g. /stream?w=320&q=60
+    width = request.args.get('w', type=int)
+    quality = request.args.get('q', type=int)
+    hub = camera.hub
+    if width or quality:
+        # Round to a multiple of 16 so near-identical requests share a variant
+        width = (width or camera.width) // 16 * 16
+        quality = quality or 80
+        if not (64 <= width <= camera.width) or not (10 <= quality <= 95):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid stream variant',
+                'error_type': 'PARAMETER_ERROR',
+                'resolution': f"Use 64 <= w <= {camera.width} and 10 <= q <= 95"
+            }), 400
+        try:
+            hub = camera.get_variant(width, quality).hub
+        except RuntimeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 503
+    return Response(generate_frames(hub),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/snapshot')
+def snapshot():
+    # Latest JPEG exactly as captured, cacheable by sequence number
+    seq, timestamp, frame = camera.hub.snapshot()
+    if frame is None or time.time() - timestamp > camera.stall_timeout:
+        # Capture is idle (or was never started): wake it for one fresh frame,
+        # the linger keeps it warm for the requests that usually follow
+        camera.acquire('snapshot')
+        try:
+            camera.hub.wait_for_frame(seq, timeout=STARTUP_TIMEOUT)
+        finally:
+            camera.release('snapshot')
+        seq, timestamp, frame = camera.hub.snapshot()
+    if frame is None:
+        return jsonify({
+            'success': False,
+            'error': 'No camera frame available',
+            'error_type': 'CAMERA_ERROR',
+            'resolution': 'Wait for the camera to start'
+        }), 503
+
+    frame, position = geotagger.tag(frame, timestamp)
+    response = Response(frame, mimetype='image/jpeg')
+    response.set_etag(f"{camera.started_at:.0f}-{seq}{'-gps' if position else ''}")
+    response.last_modified = datetime.fromtimestamp(timestamp, timezone.utc)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/camera/config', methods=['GET'])
+def get_camera_config():
+    return jsonify(dict(camera.config(), camera=camera.health()))
+
+@app.route('/camera/config', methods=['POST'])
+def set_camera_config():
+    # e.g. {"width": 320, "height": 240, "framerate": 15}; omitted fields keep their value
+    data = request.get_json(silent=True) or {}
+    if 'codec' in data and data['codec'] != camera.codec:
+        return jsonify({
+            'success': False,
+            'error': 'The codec cannot be changed at runtime',
+            'error_type': 'PARAMETER_ERROR',
+            'resolution': f"Stream consumers expect {camera.codec}; restart the server to change it"
+        }), 400
+    try:
+        width = int(data.get('width', camera.width))
+        height = int(data.get('height', camera.height))
+        framerate = int(data.get('framerate', camera.framerate))
+    except (TypeError, ValueError):
+        width = height = framerate = 0
+    if not (64 <= width <= CAMERA_MAX_WIDTH and 64 <= height <= CAMERA_MAX_HEIGHT and
+            1 <= framerate <= CAMERA_MAX_FRAMERATE) or width % 2 or height % 2:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid camera configuration',
+            'error_type': 'PARAMETER_ERROR',
+            'resolution': f"Use even 64 <= width <= {CAMERA_MAX_WIDTH}, 64 <= height <= {CAMERA_MAX_HEIGHT} "
+                          f"and 1 <= framerate <= {CAMERA_MAX_FRAMERATE}"
+        }), 400
+
+    seq, _ = camera.hub.latest()
+    camera.reconfigure(width, height, framerate)
+    applied = None
+    if camera.demand:
+        # Stream clients hold the last frame meanwhile; wait until the new mode
+        # delivers a frame or the supervisor gives up and reverts it
+        deadline = time.time() + STARTUP_TIMEOUT + 2
+        while camera.previous_config is not None and time.time() < deadline:
+            seq, _, _ = camera.hub.wait_for_frame(seq, timeout=0.5)
+        applied = (camera.previous_config is None and
+                   (camera.width, camera.height, camera.framerate) == (width, height, framerate))
+    return jsonify(dict(camera.config(), success=applied is not False, applied=applied,
+                        camera=camera.health()))
+
+@app.route('/stats/video', methods=['GET'])
+def get_video_stats():
+    video_stats = stats.snapshot()
+    with camera.consumers_lock:
+        video_stats['consumers'] = {c.name: {'policy': c.policy, 'dropped': c.dropped}
+                                    for c in camera.consumers}
+    video_stats['stream_clients'] = camera.hub.subscribers
+    video_stats['uploads'] = dict(upload_queue.stats(), snapshots_queued=uploader.queued)
+    if uploader.detector:
+        video_stats['uploads'].update({
+            'checked': uploader.detector.checked,
+            'unchanged': uploader.detector.skipped,
+            'last_change_score': uploader.detector.last_score
+        })
+    video_stats['frames_captured'] = camera.frame_count
+    video_stats['camera'] = camera.health()
+    video_stats['governor'] = governor.status()
+    return jsonify(video_stats)
+
+@app.route('/stats/video/reset', methods=['POST'])
+def reset_video_stats():
+    stats.reset()
+    return jsonify({'success': True})
+
 @app.route('/telemetry', methods=['GET'])
 def get_telemetry():
+    return jsonify(pixhawk.telemetry_snapshot())
+
+def recording_window():
+    """(start, end) epoch seconds from the query string, or an error response"""
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    if start is None or end is None or end <= start:
+        return None, (jsonify({
+            'success': False,
+            'error': 'Invalid time window',
+            'error_type': 'PARAMETER_ERROR',
+            'resolution': 'Pass start and end as epoch seconds with end > start'
+        }), 400)
+    return (start, end), None
+
+@app.route('/recordings', methods=['GET'])
+def list_recordings():
     return jsonify({
-        'connected': pixhawk.check_connection_health(),
-        'lat': pixhawk.lat,
-        'lon': pixhawk.lon,
-        'alt': pixhawk.alt,
-        'relative_alt': pixhawk.relative_alt,
-        'heading': pixhawk.heading,
-        'groundspeed': pixhawk.groundspeed,
-        'battery_percentage': pixhawk.battery_percentage,
-        'mode': pixhawk.mode,
-        'battery_voltage': pixhawk.battery_voltage,
-        'battery_current': pixhawk.battery_current,
-        'battery_consumed': pixhawk.battery_consumed,
-        'armed': pixhawk.armed,
-        'gps_fix_type': pixhawk.gps_fix_type,
-        'satellites_visible': pixhawk.satellites_visible,
-        'mission_in_progress': pixhawk.mission_in_progress,
-        'current_waypoint': pixhawk.current_waypoint,
-        'total_waypoints': pixhawk.total_waypoints
+        'success': True,
+        'recording': recorder.running,
+        'codec': recorder.codec,
+        'segments': recorder.list_segments()
     })
 
+@app.route('/recordings/clip', methods=['GET'])
+def get_recording_clip():
+    window, error = recording_window()
+    if error:
+        return error
+    pieces = recorder.clip(*window)
+    total = sum(last - first for _, first, last in pieces)
+    if not total:
+        recorder.release(pieces)
+        return jsonify({
+            'success': False,
+            'error': 'No recorded video in this time window',
+            'error_type': 'NOT_FOUND',
+            'resolution': 'List /recordings for the recorded time ranges'
+        }), 404
+
+    # Byte ranges are over the clip as a whole, so players can seek in it
+    first, stop, status = 0, total, 200
+    if request.range:
+        byte_range = request.range.range_for_length(total)
+        if byte_range is None:
+            recorder.release(pieces)
+            return Response(status=416, headers={'Content-Range': f"bytes */{total}"})
+        first, stop = byte_range
+        status = 206
+
+    response = Response(read_pieces(pieces, first, stop), status=status, mimetype=recorder.mimetype)
+    # Runs when the response is closed, whether or not the body was sent
+    response.call_on_close(lambda: recorder.release(pieces))
+    response.content_length = stop - first
+    response.accept_ranges = 'bytes'
+    if status == 206:
+        response.content_range = ContentRange('bytes', first, stop, total)
+    extension = os.path.splitext(pieces[0][0])[1]
+    response.headers['Content-Disposition'] = \
+        f"attachment; filename=clip-{int(window[0])}-{int(window[1])}{extension}"
+    return response
+
+@app.route('/recordings/telemetry', methods=['GET'])
+def get_recording_telemetry():
+    window, error = recording_window()
+    if error:
+        return error
+    return jsonify({'success': True, 'samples': recorder.telemetry_between(*window)})
+
 @app.route('/logs', methods=['GET'])
 def get_logs():
     with pixhawk.logs_lock:
@@ -900,9 +1129,23 @@ def get_mission_status():
 if __name__ == '__main__':
     try:
         # Start camera capture
-        camera.start_capture()
+        camera.start()
         logger.info("Camera stream initialized")
 
+        if SNAPSHOT_UPLOAD_INTERVAL > 0:
+            uploader.start()
+
+        if ENABLE_RECORDING:
+            recorder.start()
+
+        if ENABLE_GOVERNOR:
+            governor.start()
+
+        if ENABLE_WEBRTC:
+            import webrtcStream
+            Thread(target=webrtcStream.run, args=(camera,), daemon=True).start()
+            logger.info("WebRTC stream sharing the camera capture")
+
         # Enable debug mode for better error messages
         app.config['DEBUG'] = True
         
@@ -916,4 +1159,7 @@ if __name__ == '__main__':
         # Ensure clean disconnect on server shutdown
         if pixhawk.connected:
             pixhawk.disconnect()
-        camera.cleanup()
\ No newline at end of file
+        governor.stop()
+        uploader.stop()
+        recorder.stop()
+        camera.stop()
\ No newline at end of file
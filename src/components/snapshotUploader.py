@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotUploader:
+    """Periodically queues the latest camera JPEG for the image upload service.
+
+    The JPEG is taken straight from the capture (no decode or re-encode) and
+    handed to an UploadQueue, which spools it to disk and sends it in the
+    background. Unchanged frames (same sequence number) are not queued
+    again. With a geotagger the JPEG carries EXIF GPS tags and the metadata
+    the same position. With a change detector the latest frame is checked
+    every interval and only queued when the scene changed. pause() stops
+    checking and queueing (the resource governor uses it to shed load)
+    without stopping the upload of what is already spooled.
+
+    With a camera and an active() callable, the uploader only holds the
+    camera (CameraService.acquire) while active() is true, e.g. while the
+    vehicle is armed, so demand-driven capture can stop on the ground. Fresh
+    frames are uploaded either way, e.g. while a viewer keeps the camera on.
+    """
+
+    def __init__(self, hub, queue, interval=3.0, geotagger=None, detector=None, camera=None,
+                 active=None):
+        self.hub = hub
+        self.queue = queue
+        self.interval = interval
+        self.geotagger = geotagger
+        self.detector = detector
+        self.camera = camera
+        self.active = active
+        self.holding = False
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_seq = 0
+        self.queued = 0
+        self.paused = False
+
+    def start(self):
+        if self.thread is None:
+            self.stop_event.clear()
+            self.queue.start()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            logger.info(f"Snapshot uploader started ({self.interval}s interval)")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self._hold_camera(False)
+        self.queue.stop()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def _hold_camera(self, wanted):
+        if self.camera is None or wanted == self.holding:
+            return
+        self.holding = wanted
+        if wanted:
+            self.camera.acquire('uploader')
+        else:
+            self.camera.release('uploader')
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._hold_camera(not self.paused and (self.active is None or self.active()))
+            if self.paused:
+                continue
+            seq, timestamp, frame = self.hub.snapshot()
+            if frame is None or seq == self.last_seq:
+                continue
+            if time.time() - timestamp > max(2 * self.interval, 1.0):
+                continue  # Nobody runs the camera, the hub only holds an old frame
+            if self.detector and not self.detector.should_upload(frame, timestamp):
+                continue
+            try:
+                self.upload(frame, timestamp)
+                if self.detector:
+                    self.detector.accept()
+                self.last_seq = seq
+                self.queued += 1
+            except Exception as e:
+                logger.warning(f"Could not queue snapshot: {str(e)}")
+
+    def upload(self, frame, timestamp):
+        position = None
+        if self.geotagger:
+            frame, position = self.geotagger.tag(frame, timestamp)
+        metadata = {'timestamp': int(timestamp * 1000)}
+        if position:
+            metadata.update({
+                'latitude': round(position.lat, 7),
+                'longitude': round(position.lon, 7),
+                'altitude': round(position.alt, 2),
+                'heading': round(position.heading, 1)
+            })
+        self.queue.enqueue(frame, metadata)
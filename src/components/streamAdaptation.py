@@ -0,0 +1,201 @@
+import asyncio
+import collections
+import logging
+
+import aiortc
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from videoStats import stats
+
+logger = logging.getLogger("webrtc_stream")
+
+Rung = collections.namedtuple('Rung', ['width', 'height', 'framerate', 'bitrate'])
+
+# Best first. Resolutions keep the sensor's 4:3 aspect, bitrates are encoder targets in bps
+QUALITY_LADDER = [
+    Rung(1296, 972, 20, 1500000),
+    Rung(960, 720, 20, 1000000),
+    Rung(640, 480, 15, 600000),
+    Rung(480, 360, 12, 350000),
+    Rung(320, 240, 8, 200000),
+]
+
+# Step down when any of these is exceeded in a stats interval
+DOWN_LOSS = 0.08
+DOWN_RTT = 0.6
+# Step up only after UP_STABLE_CHECKS intervals below both of these
+UP_LOSS = 0.02
+UP_RTT = 0.3
+UP_STABLE_CHECKS = 5
+# Step down when the receiver's REMB estimate is below this share of the rung's bitrate
+DOWN_BANDWIDTH_RATIO = 0.7
+
+
+class AdaptiveVideoTrack(MediaStreamTrack):
+    """Per-viewer view of the shared camera track at the viewer's current rung.
+
+    Frames above the rung's frame rate are skipped (using capture pts) and
+    larger frames are scaled down. aiortc's encoders reinitialise themselves
+    on a size change, so switching rungs keeps the same RTP session.
+    """
+    kind = "video"
+
+    def __init__(self, source, ladder=None, capture_time=None):
+        super().__init__()
+        self.source = source
+        self.ladder = ladder or QUALITY_LADDER
+        self.level = 0
+        self.capture_time = capture_time
+        self._last_sent = None
+        self._in_flight = None
+
+    @property
+    def rung(self):
+        return self.ladder[self.level]
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        # aiortc asks for the next frame once the previous one is encoded and sent
+        if self._in_flight is not None:
+            stats.record('sent', self._in_flight)
+            self._in_flight = None
+
+        while True:
+            frame = await self.source.recv()
+            rung = self.rung
+            t = float(frame.pts * frame.time_base)
+            # 10% slack so jitter in the capture clock does not halve the rate
+            if self._last_sent is not None and 0 <= t - self._last_sent < 0.9 / rung.framerate:
+                continue
+            self._last_sent = t
+            break
+
+        if frame.width > rung.width:
+            scaled = frame.reformat(width=rung.width, height=rung.height)
+            scaled.pts, scaled.time_base = frame.pts, frame.time_base
+            frame = scaled
+
+        if self.capture_time:
+            self._in_flight = self.capture_time(frame.pts)
+            stats.record('to_encoder', self._in_flight)
+        stats.tick('webrtc')
+        return frame
+
+    def stop(self):
+        super().stop()
+        self.source.stop()
+
+
+# Where aiortc 1.x keeps a sender's encoder (the name-mangled RTCRtpSender.__encoder)
+ENCODER_ATTRIBUTE = '_RTCRtpSender__encoder'
+
+
+def sender_encoder(sender):
+    """The encoder aiortc created for this sender, or None.
+
+    aiortc has no public API for the send bitrate. Its REMB handling writes
+    the receiver's estimate straight into the private encoder's
+    target_bitrate, so that attribute is the only place to read the
+    estimate and to cap the bitrate to the ladder. The encoder is created
+    with the first frame; keep every use of it in here.
+    """
+    encoder = getattr(sender, ENCODER_ATTRIBUTE, None)
+    if encoder is None or not hasattr(encoder, 'target_bitrate'):
+        return None
+    return encoder
+
+
+class QualityController:
+    """Moves one viewer's AdaptiveVideoTrack along the ladder from RTCP feedback.
+
+    Loss and RTT come from the remote-inbound stats aiortc builds from the
+    receiver reports. The receiver's REMB estimate, which aiortc writes into
+    the encoder's target bitrate, is used as the available bitrate until the
+    next estimate arrives.
+    """
+
+    def __init__(self, pc, sender, track, interval=2.0):
+        self.pc = pc
+        self.sender = sender
+        self.track = track
+        self.interval = interval
+        self.stable_checks = 0
+        self.applied_bitrate = None
+        # Latest REMB estimate, kept until the receiver sends a new one
+        self.available_bitrate = None
+        self.last_packets_lost = None
+        self.task = None
+        if not hasattr(sender, ENCODER_ATTRIBUTE):
+            logger.warning(f"aiortc {aiortc.__version__} hides the sender's encoder differently, "
+                           "bitrate adaptation is off (resolution and frame rate still adapt)")
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        try:
+            while self.pc.connectionState not in ("closed", "failed"):
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.check()
+                except Exception as e:
+                    logger.error(f"Quality check failed: {str(e)}")
+        except asyncio.CancelledError:
+            pass
+
+    async def check(self):
+        loss = rtt = None
+        report = await self.pc.getStats()
+        for entry in report.values():
+            if entry.type == "remote-inbound-rtp" and entry.kind == "video":
+                loss = entry.fractionLost / 256.0
+                rtt = entry.roundTripTime
+                if entry.packetsLost == self.last_packets_lost:
+                    # fractionLost only covers the last report, ignore a stale one
+                    loss = 0.0
+                self.last_packets_lost = entry.packetsLost
+        if loss is None:
+            return
+
+        encoder = sender_encoder(self.sender)
+        if encoder is not None and self.applied_bitrate is not None and \
+                encoder.target_bitrate != self.applied_bitrate:
+            # aiortc overwrote our cap, so a new REMB estimate has arrived
+            self.available_bitrate = encoder.target_bitrate
+        available = self.available_bitrate
+
+        level = self.track.level
+        congested = (loss > DOWN_LOSS or (rtt is not None and rtt > DOWN_RTT) or
+                     (available is not None and available < self.track.rung.bitrate * DOWN_BANDWIDTH_RATIO))
+        if congested:
+            self.stable_checks = 0
+            level = min(level + 1, len(self.track.ladder) - 1)
+        elif loss < UP_LOSS and (rtt is None or rtt < UP_RTT):
+            self.stable_checks += 1
+            if self.stable_checks >= UP_STABLE_CHECKS:
+                self.stable_checks = 0
+                level = max(level - 1, 0)
+        else:
+            self.stable_checks = 0
+
+        if level != self.track.level:
+            self.track.level = level
+            rung = self.track.rung
+            logger.info(f"Video quality -> {rung.width}x{rung.height}@{rung.framerate} "
+                        f"{rung.bitrate // 1000} kbps (loss {loss:.1%}, rtt {rtt})")
+
+        if encoder is not None:
+            bitrate = self.track.rung.bitrate
+            if available is not None:
+                bitrate = min(bitrate, available)
+            encoder.target_bitrate = bitrate
+            # The encoder clamps, remember what it actually kept
+            self.applied_bitrate = encoder.target_bitrate
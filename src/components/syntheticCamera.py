@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+"""Stand-in for libcamera-vid on machines without a Pi camera.
+
+Takes the libcamera-vid arguments CameraService passes (--width, --height,
+--framerate, --codec, -t, --intra, --output) and writes the same kind of
+stream at the requested frame rate: concatenated JPEGs or Annex-B H.264
+with inline headers. Frames show a moving test pattern with the frame
+number as text and as a row of black/white cells along the bottom edge
+(see read_counter), so a consumer can count dropped frames.
+
+With --replay the frames of an MJPEG or H.264 file are written instead,
+paced at --framerate and looped.
+
+    python syntheticCamera.py --width 640 --height 480 --framerate 40 --codec mjpeg -o - | ...
+    CAMERA_SOURCE=synthetic python serverWithCam.py
+    CAMERA_SOURCE=/path/to/flight.mjpeg python serverWithCam.py
+"""
+import argparse
+import sys
+import time
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # Replay works without OpenCV
+    cv2 = None
+    np = None
+
+from cameraPipeline import JpegFrameScanner, H264AccessUnitParser
+
+# Frame number as 24 cells along the bottom edge, most significant bit first
+COUNTER_BITS = 24
+
+
+class Pacer:
+    """Sleeps until the next frame is due; a consumer that falls behind blocks the pipe instead"""
+
+    def __init__(self, framerate):
+        self.period = 1.0 / framerate
+        self.due = time.monotonic()
+
+    def wait(self):
+        self.due += self.period
+        delay = self.due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -1.0:
+            self.due = time.monotonic()  # Do not burst to catch up after a long block
+
+
+def _counter_cells(width, height):
+    cell = max(4, width // (COUNTER_BITS + 8))
+    y = height - cell
+    for bit in range(COUNTER_BITS):
+        yield bit, y, cell * (bit + 4), cell
+
+
+def draw_counter(image, number):
+    for bit, y, x, cell in _counter_cells(image.shape[1], image.shape[0]):
+        image[y:y + cell, x:x + cell] = 255 if number >> (COUNTER_BITS - 1 - bit) & 1 else 0
+
+
+def read_counter(gray):
+    """Frame number drawn by draw_counter into a (decoded) grayscale frame"""
+    number = 0
+    for bit, y, x, cell in _counter_cells(gray.shape[1], gray.shape[0]):
+        margin = cell // 4
+        block = gray[y + margin:y + cell - margin, x + margin:x + cell - margin]
+        number = number << 1 | int(block.mean() > 128)
+    return number
+
+
+class TestPattern:
+    """BGR frames: colour gradient scrolling sideways, a bouncing square and the frame number"""
+
+    def __init__(self, width, height):
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        self.background = np.dstack([
+            np.tile(x, (height, 1)),
+            np.tile(y[:, None], (1, width)),
+            np.tile(255 - x, (height, 1))
+        ])
+        self.width = width
+        self.height = height
+
+    def frame(self, number):
+        image = np.roll(self.background, number * 4 % self.width, axis=1)
+        size = self.height // 6
+        span = self.width - size
+        x = abs(number * 6 % (2 * span) - span)
+        y = self.height // 3
+        image[y:y + size, x:x + size] = 255
+        cv2.putText(image, f"{number:06d}", (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 6)
+        cv2.putText(image, f"{number:06d}", (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
+        draw_counter(image, number)
+        return image
+
+
+def mjpeg_encoder(quality=80):
+    def encode(image):
+        ok, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return [data.tobytes()] if ok else []
+    return encode
+
+
+def h264_encoder(width, height, framerate, intra):
+    """Baseline libx264 via PyAV, one keyframe every intra frames with SPS/PPS repeated"""
+    import av
+    from fractions import Fraction
+
+    codec = av.CodecContext.create('libx264', 'w')
+    codec.width = width
+    codec.height = height
+    codec.pix_fmt = 'yuv420p'
+    codec.framerate = Fraction(framerate).limit_denominator(1000)
+    codec.time_base = 1 / codec.framerate
+    codec.options = {
+        'profile': 'baseline',
+        'preset': 'ultrafast',
+        'tune': 'zerolatency',
+        # One slice per picture like libcamera-vid (zerolatency would slice per thread)
+        'x264-params': f"keyint={intra}:min-keyint={intra}:repeat-headers=1:slices=1"
+    }
+
+    def encode(image):
+        frame = av.VideoFrame.from_ndarray(image, format='bgr24').reformat(format='yuv420p')
+        return [bytes(packet) for packet in codec.encode(frame)]
+    return encode
+
+
+def generate(args, output):
+    if cv2 is None:
+        raise SystemExit("OpenCV is required for the synthetic test pattern")
+    pattern = TestPattern(args.width, args.height)
+    if args.codec == 'h264':
+        encode = h264_encoder(args.width, args.height, args.framerate, args.intra or round(args.framerate))
+    else:
+        encode = mjpeg_encoder(args.quality)
+
+    pacer = Pacer(args.framerate)
+    deadline = time.monotonic() + args.timeout / 1000.0 if args.timeout else None
+    number = 0
+    while deadline is None or time.monotonic() < deadline:
+        for data in encode(pattern.frame(number)):
+            output.write(data)
+        output.flush()
+        number += 1
+        pacer.wait()
+
+
+def replay(args, output):
+    pacer = Pacer(args.framerate)
+    deadline = time.monotonic() + args.timeout / 1000.0 if args.timeout else None
+    while True:
+        parser = H264AccessUnitParser() if args.codec == 'h264' else JpegFrameScanner()
+        frames = 0
+        with open(args.replay, 'rb', buffering=0) as f:
+            while parser.read_from(f):
+                for frame in parser.frames():
+                    if args.codec == 'h264':
+                        frame = frame[0]
+                    output.write(frame)
+                    output.flush()
+                    frames += 1
+                    pacer.wait()
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return
+        if not frames:
+            raise SystemExit(f"No {args.codec} frames in {args.replay}")
+        if not args.loop:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-t', '--timeout', type=int, default=5000, help='run time in ms, 0 = forever')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--framerate', type=float, default=30)
+    parser.add_argument('--codec', choices=['mjpeg', 'h264'], default='h264')
+    parser.add_argument('--intra', type=int, help='H.264 keyframe interval in frames')
+    parser.add_argument('-q', '--quality', type=int, default=80, help='JPEG quality')
+    parser.add_argument('-o', '--output', default='-')
+    parser.add_argument('--replay', help='MJPEG/H.264 file to play instead of the test pattern')
+    parser.add_argument('--no-loop', dest='loop', action='store_false', help='stop at the end of --replay')
+    # Accept the rest of libcamera-vid's options (--inline, --profile, ...) and ignore them
+    args, _ = parser.parse_known_args()
+
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        if args.replay:
+            replay(args, output)
+        else:
+            generate(args, output)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        try:
+            output.close()
+        except BrokenPipeError:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import base64
+import collections
+import http.client
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# 4xx responses that mean "try again later" rather than "bad image"
+RETRYABLE_STATUSES = (408, 429)
+
+
+class UploadQueue:
+    """Disk-spooled image upload queue.
+
+    enqueue() only writes the JPEG and its metadata into the spool directory
+    and returns; worker threads send the oldest entries over persistent
+    keep-alive connections, so a slow or dead link never holds up the
+    caller. Failed sends go back to the front of the queue and the worker
+    backs off exponentially. Entries left in the spool are sent after a
+    restart. When the spool exceeds max_bytes or max_items, the oldest
+    entries that are not in flight are evicted.
+
+    mode='json' posts one image per request as {imageData, timestamp, ...},
+    the format the upload service accepts today. mode='multipart' posts up
+    to batch_size images per request as 'images' file parts plus a
+    'metadata' part holding a JSON list in the same order.
+    """
+
+    def __init__(self, url, spool_dir, mode='json', batch_size=8, workers=2,
+                 max_bytes=200 * 1024 * 1024, max_items=2000, timeout=10,
+                 backoff_base=1.0, backoff_max=60.0):
+        self.url = urlsplit(url)
+        # Request target: path plus any query string of the upload URL
+        self.target = (self.url.path or '/') + (f"?{self.url.query}" if self.url.query else '')
+        self.spool_dir = spool_dir
+        self.mode = mode
+        self.batch_size = batch_size if mode == 'multipart' else 1
+        self.worker_count = workers
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        self.sizes = {}
+        self.in_flight = set()
+        self.total_bytes = 0
+        self.counter = 0
+        self.threads = []
+        self.running = False
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+        self.evicted = 0
+
+    def start(self):
+        if self.running:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._load_spool()
+        self.running = True
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._worker, name=f"upload-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Upload queue started ({len(self.pending)} spooled, {self.worker_count} workers)")
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=self.timeout)
+        self.threads = []
+
+    def _path(self, name):
+        return os.path.join(self.spool_dir, name)
+
+    def _load_spool(self):
+        for leftover in os.listdir(self.spool_dir):
+            if leftover.endswith('.json.tmp'):
+                os.remove(self._path(leftover))  # Metadata write interrupted by a crash
+        names = sorted(f[:-4] for f in os.listdir(self.spool_dir) if f.endswith('.jpg'))
+        with self.condition:
+            for name in names:
+                if not os.path.exists(self._path(name + '.json')):
+                    os.remove(self._path(name + '.jpg'))  # Interrupted enqueue
+                    continue
+                size = os.path.getsize(self._path(name + '.jpg'))
+                self.pending.append(name)
+                self.sizes[name] = size
+                self.total_bytes += size
+
+    def enqueue(self, jpeg, metadata):
+        """Spool an image for upload; never waits for the network"""
+        with self.condition:
+            self.counter += 1
+            name = f"{int(metadata.get('timestamp', time.time() * 1000)):013d}-{self.counter % 1000000:06d}"
+        # The .json is written last and marks the entry complete
+        with open(self._path(name + '.jpg'), 'wb') as f:
+            f.write(jpeg)
+        temp = self._path(name + '.json.tmp')
+        with open(temp, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(temp, self._path(name + '.json'))
+
+        with self.condition:
+            self.pending.append(name)
+            self.sizes[name] = len(jpeg)
+            self.total_bytes += len(jpeg)
+            self._evict()
+            self.condition.notify()
+
+    def _evict(self):
+        """Drop the oldest queued entries while the spool is over its limits (lock held)"""
+        while self.pending and (self.total_bytes > self.max_bytes or
+                                len(self.pending) + len(self.in_flight) > self.max_items):
+            name = self.pending.popleft()
+            self._forget(name)
+            self.evicted += 1
+            logger.warning(f"Upload spool full, dropped {name}")
+
+    def _forget(self, name):
+        self.total_bytes -= self.sizes.pop(name, 0)
+        for suffix in ('.jpg', '.json'):
+            try:
+                os.remove(self._path(name + suffix))
+            except OSError:
+                pass
+
+    def _claim(self):
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+            if not self.running:
+                return []
+            batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            self.in_flight.update(batch)
+            return batch
+
+    def _release(self, batch, sent, rejected=False):
+        """Finish a claimed batch: sent (or rejected) entries are deleted, others queued again"""
+        with self.condition:
+            self.in_flight.difference_update(batch)
+            if sent:
+                if rejected:
+                    self.failed += len(batch)
+                else:
+                    self.uploaded += len(batch)
+                for name in batch:
+                    self._forget(name)
+            else:
+                self.retries += 1
+                # Back to the front, oldest first
+                self.pending.extendleft(reversed(batch))
+                self._evict()
+                self.condition.notify()
+
+    def _read_entry(self, name):
+        with open(self._path(name + '.jpg'), 'rb') as f:
+            jpeg = f.read()
+        with open(self._path(name + '.json')) as f:
+            metadata = json.load(f)
+        return jpeg, metadata
+
+    def _connect(self):
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def _body(self, entries):
+        if self.mode == 'json':
+            jpeg, metadata = entries[0]
+            payload = dict(metadata, imageData='data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii'))
+            return json.dumps(payload).encode(), 'application/json'
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        for i, (jpeg, metadata) in enumerate(entries):
+            parts.append((f"--{boundary}\r\n"
+                          f"Content-Disposition: form-data; name=\"images\"; filename=\"{metadata.get('timestamp', i)}.jpg\"\r\n"
+                          "Content-Type: image/jpeg\r\n\r\n").encode() + jpeg + b'\r\n')
+        parts.append((f"--{boundary}\r\n"
+                      "Content-Disposition: form-data; name=\"metadata\"\r\n"
+                      "Content-Type: application/json\r\n\r\n").encode() +
+                     json.dumps([metadata for _, metadata in entries]).encode() + b'\r\n')
+        parts.append(f"--{boundary}--\r\n".encode())
+        return b''.join(parts), f"multipart/form-data; boundary={boundary}"
+
+    def _worker(self):
+        connection = None
+        failures = 0
+        while self.running:
+            batch = self._claim()
+            if not batch:
+                continue
+
+            entries = []
+            for name in list(batch):
+                try:
+                    entries.append(self._read_entry(name))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Dropping unreadable spool entry {name}: {str(e)}")
+                    batch.remove(name)
+                    self._release([name], True, rejected=True)
+            if not entries:
+                continue
+
+            body, content_type = self._body(entries)
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.request('POST', self.target, body=body, headers={
+                    'Content-Type': content_type,
+                    'Connection': 'keep-alive'
+                })
+                response = connection.getresponse()
+                response.read()  # Drain so the connection can be reused
+                if 400 <= response.status < 500 and response.status not in RETRYABLE_STATUSES:
+                    # The service rejected these images, retrying will not help
+                    logger.warning(f"Upload rejected with HTTP {response.status}, dropping {len(batch)} image(s)")
+                    self._release(batch, True, rejected=True)
+                    failures = 0
+                    continue
+                if response.status >= 300:
+                    raise IOError(f"HTTP {response.status}")
+                self._release(batch, True)
+                failures = 0
+            except Exception as e:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                self._release(batch, False)
+                failures += 1
+                delay = min(self.backoff_base * 2 ** (failures - 1), self.backoff_max)
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning(f"Upload failed ({str(e)}), retrying in {delay:.1f}s")
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, delay)
+
+        if connection is not None:
+            connection.close()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'queued': len(self.pending) + len(self.in_flight),
+                'spool_bytes': self.total_bytes,
+                'uploaded': self.uploaded,
+                'failed': self.failed,
+                'retries': self.retries,
+                'evicted': self.evicted
+            }
@@ -0,0 +1,307 @@
+import bisect
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# One indexed frame: capture time, byte offset in the segment, size, keyframe
+IndexEntry = collections.namedtuple('IndexEntry', ['timestamp', 'offset', 'size', 'keyframe'])
+
+SEGMENT_EXTENSIONS = {'mjpeg': '.mjpeg', 'h264': '.h264'}
+CLIP_MIMETYPES = {'mjpeg': 'video/x-motion-jpeg', 'h264': 'video/h264'}
+
+
+class VideoRecorder:
+    """Writes the camera's encoded stream to rotating segment files.
+
+    Frames are appended exactly as libcamera-vid produced them (concatenated
+    JPEGs or Annex-B H.264), so recording costs a queue hop and a buffered
+    write per frame. Each segment has a .idx file of
+    'timestamp,offset,size,keyframe' lines and a .telemetry.jsonl file with
+    the telemetry samples taken while it was open. H.264 segments rotate on a
+    keyframe so every segment decodes on its own. Oldest segments are deleted
+    once the directory exceeds max_bytes, except while a clip is being read
+    from them (clip() holds them until release()).
+    """
+
+    def __init__(self, camera, directory, segment_seconds=60, max_bytes=2 * 1024 ** 3,
+                 telemetry=None, telemetry_interval=1.0):
+        self.camera = camera
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.telemetry = telemetry
+        self.telemetry_interval = telemetry_interval
+        self.codec = camera.codec
+        self.segments = []
+        # Segment name -> number of clips currently reading it
+        self.readers = collections.Counter()
+        self.lock = threading.Lock()
+        self.consumer = None
+        self.thread = None
+        self.running = False
+        # Open segment
+        self.current = None
+        self.data_file = None
+        self.index_file = None
+        self.telemetry_file = None
+        self.current_index = []
+        self.flushed_bytes = 0
+        self.last_telemetry = 0
+        self.last_flush = 0
+
+    def start(self):
+        if self.thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_segments()
+            # Queue every frame; a short disk stall must not lose video
+            self.consumer = self.camera.subscribe('recorder', policy='queue',
+                                                  maxsize=max(self.camera.framerate * 5, 50))
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            logger.info(f"Recording to {self.directory}")
+
+    def stop(self):
+        self.running = False
+        if self.consumer:
+            self.camera.unsubscribe(self.consumer)
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self._close_segment()
+
+    def _load_segments(self):
+        """Rebuild the segment list from the index files left by earlier runs"""
+        extension = SEGMENT_EXTENSIONS[self.codec]
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(extension):
+                continue
+            index = self._read_index(os.path.join(self.directory, name + '.idx'))
+            if not index:
+                continue
+            segments.append({
+                'name': name,
+                'start': index[0].timestamp,
+                'end': index[-1].timestamp,
+                'frames': len(index),
+                'bytes': os.path.getsize(os.path.join(self.directory, name))
+            })
+        with self.lock:
+            self.segments = segments
+
+    @staticmethod
+    def _read_index(path):
+        entries = []
+        try:
+            with open(path) as f:
+                for line in f:
+                    parts = line.rstrip('\n').split(',')
+                    if len(parts) != 4:
+                        continue  # Partially written last line
+                    entries.append(IndexEntry(float(parts[0]), int(parts[1]), int(parts[2]), parts[3] == '1'))
+        except OSError:
+            pass
+        return entries
+
+    def _open_segment(self, timestamp):
+        stamp = datetime.fromtimestamp(timestamp).strftime('%Y%m%d-%H%M%S')
+        name = f"seg-{stamp}-{int(timestamp * 1000) % 1000:03d}{SEGMENT_EXTENSIONS[self.codec]}"
+        path = os.path.join(self.directory, name)
+        self.data_file = open(path, 'wb')
+        self.index_file = open(path + '.idx', 'w')
+        self.telemetry_file = open(path + '.telemetry.jsonl', 'w')
+        with self.lock:
+            self.current_index = []
+            self.flushed_bytes = 0
+            self.current = {'name': name, 'start': timestamp, 'end': timestamp, 'frames': 0, 'bytes': 0}
+            self.segments.append(self.current)
+        self.last_telemetry = 0
+
+    def _close_segment(self):
+        for f in (self.data_file, self.index_file, self.telemetry_file):
+            if f:
+                f.close()
+        self.data_file = self.index_file = self.telemetry_file = None
+        self.current = None
+
+    def _should_rotate(self, frame):
+        if self.current is None:
+            return True
+        if frame.timestamp - self.current['start'] < self.segment_seconds:
+            return False
+        return frame.keyframe
+
+    def _write(self, frame):
+        if self._should_rotate(frame):
+            if self.current is None and not frame.keyframe:
+                return  # H.264 needs a keyframe to start a segment
+            self._close_segment()
+            self._open_segment(frame.timestamp)
+            self._enforce_limit()
+
+        offset = self.current['bytes']
+        self.data_file.write(frame.data)
+        self.index_file.write(f"{frame.timestamp:.4f},{offset},{len(frame.data)},{int(frame.keyframe)}\n")
+        entry = IndexEntry(frame.timestamp, offset, len(frame.data), frame.keyframe)
+        with self.lock:
+            self.current_index.append(entry)
+            self.current['bytes'] += len(frame.data)
+            self.current['end'] = frame.timestamp
+            self.current['frames'] += 1
+
+    def _sample_telemetry(self, now):
+        if self.telemetry is None or self.telemetry_file is None:
+            return
+        if now - self.last_telemetry < self.telemetry_interval:
+            return
+        self.last_telemetry = now
+        try:
+            sample = dict(self.telemetry(), t=round(now, 3))
+            self.telemetry_file.write(json.dumps(sample) + '\n')
+        except Exception as e:
+            logger.warning(f"Telemetry sample failed: {str(e)}")
+
+    def _run(self):
+        try:
+            while self.running:
+                frame = self.consumer.get(timeout=1.0)
+                now = time.time()
+                if frame is not None:
+                    self._write(frame)
+                self._sample_telemetry(now)
+                # Bounded loss on power cut without a flush per frame
+                if self.data_file and now - self.last_flush > 1.0:
+                    self.last_flush = now
+                    for f in (self.data_file, self.index_file, self.telemetry_file):
+                        f.flush()
+                    with self.lock:
+                        self.flushed_bytes = self.current['bytes']
+        except Exception as e:
+            logger.error(f"Recorder stopped: {str(e)}")
+        finally:
+            self._close_segment()
+
+    def _enforce_limit(self):
+        with self.lock:
+            total = sum(s['bytes'] for s in self.segments)
+            # Never the open (last) segment
+            for oldest in self.segments[:-1]:
+                if total <= self.max_bytes:
+                    break
+                if self.readers[oldest['name']]:
+                    continue
+                self.segments.remove(oldest)
+                total -= oldest['bytes']
+                path = os.path.join(self.directory, oldest['name'])
+                for suffix in ('', '.idx', '.telemetry.jsonl'):
+                    try:
+                        os.remove(path + suffix)
+                    except OSError:
+                        pass
+                logger.info(f"Deleted old recording {oldest['name']}")
+
+    def list_segments(self):
+        with self.lock:
+            return [dict(s) for s in self.segments]
+
+    def _index_for(self, segment):
+        with self.lock:
+            if segment is self.current:
+                # Only frames already flushed to disk can be served
+                end = bisect.bisect_right([e.offset + e.size for e in self.current_index], self.flushed_bytes)
+                return self.current_index[:end]
+        return self._read_index(os.path.join(self.directory, segment['name'] + '.idx'))
+
+    def clip(self, start, end):
+        """(path, first byte, end byte) pieces that together hold the frames in [start, end].
+
+        The segments are kept from deletion until release(pieces) is called.
+        """
+        pieces = []
+        with self.lock:
+            segments = [s for s in self.segments if s['end'] >= start and s['start'] <= end]
+            for segment in segments:
+                self.readers[segment['name']] += 1
+        used = set()
+        for segment in segments:
+            index = self._index_for(segment)
+            timestamps = [e.timestamp for e in index]
+            first = bisect.bisect_left(timestamps, start)
+            last = bisect.bisect_right(timestamps, end)
+            # Also empty when start is past the frames flushed so far
+            if first >= last:
+                continue
+            if not pieces:
+                # The clip has to begin on a keyframe to be decodable
+                while first > 0 and not index[first].keyframe:
+                    first -= 1
+            pieces.append((os.path.join(self.directory, segment['name']),
+                           index[first].offset, index[last - 1].offset + index[last - 1].size))
+            used.add(segment['name'])
+        self._release_names(s['name'] for s in segments if s['name'] not in used)
+        return pieces
+
+    def release(self, pieces):
+        """Allow the segments of a clip() result to be deleted again"""
+        self._release_names(os.path.basename(path) for path, _, _ in pieces)
+
+    def _release_names(self, names):
+        with self.lock:
+            for name in names:
+                self.readers[name] -= 1
+                if self.readers[name] <= 0:
+                    del self.readers[name]
+
+    def telemetry_between(self, start, end):
+        samples = []
+        with self.lock:
+            segments = [s for s in self.segments if s['end'] >= start - self.telemetry_interval
+                        and s['start'] <= end]
+        for segment in segments:
+            path = os.path.join(self.directory, segment['name'] + '.telemetry.jsonl')
+            try:
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            sample = json.loads(line)
+                        except ValueError:
+                            continue
+                        if start <= sample.get('t', 0) <= end:
+                            samples.append(sample)
+            except OSError:
+                continue
+        return samples
+
+    @property
+    def mimetype(self):
+        return CLIP_MIMETYPES[self.codec]
+
+
+def read_pieces(pieces, start, stop, chunk_size=256 * 1024):
+    """Yield bytes [start, stop) of the pieces concatenated"""
+    position = 0
+    for path, first, last in pieces:
+        length = last - first
+        if position + length <= start:
+            position += length
+            continue
+        if position >= stop:
+            break
+        skip = max(start - position, 0)
+        remaining = min(stop, position + length) - (position + skip)
+        with open(path, 'rb') as f:
+            f.seek(first + skip)
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        position += length
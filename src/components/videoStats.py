@@ -0,0 +1,179 @@
+"""Video pipeline latency and frame rate statistics.
+
+Stages record milliseconds since the frame's capture read time, so each
+stage's percentiles show how much latency has built up by that point:
+published (fanned out), decoded, to_encoder, sent (RTP written) and
+http_sent (MJPEG chunk written). parse_time (finding the frame in the
+bytes read) and decode_time are those steps' own durations.
+
+Test mode (VIDEO_TIMESTAMP_BARCODE=1) stamps the capture time into the
+WebRTC frames as a barcode. On a viewer with an NTP-synced clock, decode a
+screenshot to get the latency from reading the frame off libcamera-vid to
+showing it in the browser. Exposure and the camera's own encode, usually
+one or two frame periods, come on top of that:
+
+    python videoStats.py screenshot.png [--received <epoch seconds>]
+"""
+import argparse
+import collections
+import os
+import threading
+import time
+
+try:
+    import cv2
+except ImportError:  # Only the barcode reader needs it
+    cv2 = None
+
+TIMESTAMP_BARCODE = os.environ.get('VIDEO_TIMESTAMP_BARCODE', '0') == '1'
+
+# 40 bits of milliseconds in a 20x2 grid of square cells across the top of the frame
+BARCODE_BITS = 40
+BARCODE_COLUMNS = 20
+
+
+class RollingPercentiles:
+    """Percentiles over the last window samples"""
+
+    def __init__(self, window=500):
+        self.samples = collections.deque(maxlen=window)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def summary(self):
+        values = sorted(self.samples)
+        if not values:
+            return {'count': 0}
+
+        def pick(p):
+            return round(values[min(len(values) - 1, int(p * len(values)))], 2)
+        return {'count': len(values), 'p50': pick(0.5), 'p90': pick(0.9),
+                'p99': pick(0.99), 'max': round(values[-1], 2)}
+
+
+class RateCounter:
+    """Events per second over a sliding window"""
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.events = collections.deque()
+
+    def tick(self, now):
+        self.events.append(now)
+        self._trim(now)
+
+    def _trim(self, now):
+        while self.events and now - self.events[0] > self.window:
+            self.events.popleft()
+
+    def rate(self, now):
+        self._trim(now)
+        return round(len(self.events) / self.window, 2)
+
+
+class PipelineStats:
+    """Thread-safe per-stage latency percentiles and per-output frame rates"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.rates = {}
+        self.started_at = time.time()
+
+    def record(self, stage, since, now=None):
+        """Record the latency of a stage as milliseconds since the 'since' timestamp"""
+        now = time.time() if now is None else now
+        with self.lock:
+            stage_stats = self.stages.get(stage)
+            if stage_stats is None:
+                stage_stats = self.stages[stage] = RollingPercentiles()
+            stage_stats.add((now - since) * 1000.0)
+
+    def tick(self, name, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            counter = self.rates.get(name)
+            if counter is None:
+                counter = self.rates[name] = RateCounter()
+            counter.tick(now)
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            return {
+                'uptime': round(now - self.started_at, 1),
+                'latency_ms': {name: s.summary() for name, s in self.stages.items()},
+                'fps': {name: c.rate(now) for name, c in self.rates.items()},
+                'timestamp_barcode': TIMESTAMP_BARCODE
+            }
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.rates.clear()
+            self.started_at = time.time()
+
+
+# Shared by the capture, HTTP streams and WebRTC tracks of this process
+stats = PipelineStats()
+
+
+def _barcode_cells(width):
+    cell = max(4, width // BARCODE_COLUMNS)
+    for bit in range(BARCODE_BITS):
+        row, column = divmod(bit, BARCODE_COLUMNS)
+        yield bit, row * cell, column * cell, cell
+
+
+def draw_barcode(luma, timestamp):
+    """Write timestamp (epoch seconds) into a luma plane, in place"""
+    value = int(timestamp * 1000) % (1 << BARCODE_BITS)
+    for bit, y, x, cell in _barcode_cells(luma.shape[1]):
+        luma[y:y + cell, x:x + cell] = 235 if value >> (BARCODE_BITS - 1 - bit) & 1 else 16
+
+
+def read_barcode(gray, now=None):
+    """Timestamp (epoch seconds) encoded in a grayscale image by draw_barcode"""
+    value = 0
+    for bit, y, x, cell in _barcode_cells(gray.shape[1]):
+        margin = cell // 4
+        block = gray[y + margin:y + cell - margin, x + margin:x + cell - margin]
+        value = value << 1 | int(block.mean() > 128)
+    # Restore the high bits dropped by the modulo from the reference time
+    now = time.time() if now is None else now
+    period = 1 << BARCODE_BITS
+    now_ms = int(now * 1000)
+    candidate = now_ms - now_ms % period + value
+    if candidate > now_ms + period // 2:
+        candidate -= period
+    return candidate / 1000.0
+
+
+def stamp_video_frame(frame, timestamp):
+    """Copy of a decoded yuv420p av.VideoFrame (before pts is set) with the barcode drawn in"""
+    from av import VideoFrame
+    planes = frame.to_ndarray()
+    draw_barcode(planes[:frame.height], timestamp)
+    return VideoFrame.from_ndarray(planes, format='yuv420p')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('image', help='screenshot of the video element, cropped to the video')
+    parser.add_argument('--received', type=float, help='epoch seconds the frame was shown (default: now)')
+    args = parser.parse_args()
+
+    if cv2 is None:
+        raise SystemExit("OpenCV is required to read the barcode")
+
+    gray = cv2.imread(args.image, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise SystemExit(f"Cannot read {args.image}")
+    received = args.received or time.time()
+    captured = read_barcode(gray, received)
+    print(f"captured {captured:.3f} received {received:.3f} latency {(received - captured) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
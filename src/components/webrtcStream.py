@@ -1,14 +1,20 @@
 import asyncio
-import subprocess
+import os
 import time
 import threading
-import numpy as np
-import cv2
+import av
 import socketio
 import logging
+from fractions import Fraction
 
-from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, MediaStreamTrack
-from av import VideoFrame
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, MediaStreamTrack, RTCRtpSender
+from aiortc.contrib.media import MediaRelay
+from aiortc.mediastreams import MediaStreamError
+from av import Packet
+
+from cameraPipeline import CameraService
+from streamAdaptation import AdaptiveVideoTrack, QualityController
+from videoStats import stats, stamp_video_frame, TIMESTAMP_BARCODE
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -20,63 +26,84 @@ main_loop = asyncio.get_event_loop()
 # Create a Socket.IO client instance and connect explicitly to the /video namespace
 sio = socketio.Client()
 
-# Global peer connection variable
-pc = None
+# Peer connections of the viewers currently watching, keyed by client ID
+peers = {}
+
+# One camera track shared by every viewer through the relay
+relay = MediaRelay()
+source_track = None
+
+# Client ID assumed for signals from dashboards that do not send one
+DEFAULT_CLIENT_ID = 'control'
+
+MAX_VIEWERS = int(os.environ.get('WEBRTC_MAX_VIEWERS', 4))
+
+# Shared CameraService when running inside another process (see run())
+camera_service = None
+
+# 'mjpeg' decodes and re-encodes with aiortc, 'h264' forwards the camera's
+# hardware H.264 without touching the pixels
+WEBRTC_MODE = os.environ.get('WEBRTC_MODE', 'mjpeg').lower()
+
+# Seconds recv() waits for a new camera frame before giving up
+FRAME_TIMEOUT = 5.0
 
 class LibcameraVideoStreamTrack(MediaStreamTrack):
     kind = "video"
 
-    def __init__(self, width=1296, height=972, framerate=20):
+    def __init__(self, width=1296, height=972, framerate=20, camera=None):
         super().__init__()
         self.width = width
         self.height = height
         self.framerate = framerate
-        self._process = None
-        self._frame_buffer = None
-        self._start_capture()
+        # Use the shared capture when given one, otherwise own a private one
+        self._owns_camera = camera is None
+        self._camera = camera or CameraService(width=width, height=height, framerate=framerate)
+        self._consumer = None
+        # Newest JPEG from the camera; decoded only when recv() sends it
+        self._latest = None
+        self._decoded_seq = None
+        # Last frame sent, repeated while the camera restarts
+        self._last_frame = None
+        self._decoder = av.CodecContext.create("mjpeg", "r")
+        # Set from the reader thread through the event loop when a new frame arrives
+        self._loop = asyncio.get_event_loop()
+        self._new_frame = asyncio.Event()
+        self._first_timestamp = None
         self._start_time = time.time()
         self._frame_count = 0
-        self._timestamp = 0
-        self._timebase_num = 1
-        self._timebase_den = 90000
+        self._start_capture()
 
     def _start_capture(self):
-        command = [
-            "libcamera-vid",
-            "-t", "0",
-            "--inline",
-            "--width", str(self.width),
-            "--height", str(self.height),
-            "--framerate", str(self.framerate),
-            "--codec", "mjpeg",
-            "--output", "-"
-        ]
-        logging.info("Starting camera: " + " ".join(command))
-        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+        self._consumer = self._camera.subscribe("webrtc", policy="latest", decodes=True)
+        if self._owns_camera:
+            self._camera.start()
         threading.Thread(target=self._read_frames, daemon=True).start()
 
     def _read_frames(self):
-        frame_data = bytearray()
-        while True:
-            chunk = self._process.stdout.read(8192)
-            if not chunk:
-                break
-            frame_data.extend(chunk)
-            start = frame_data.find(b'\xff\xd8')
-            end = frame_data.find(b'\xff\xd9')
-            if start != -1 and end != -1 and end > start:
-                jpeg_bytes = frame_data[start:end + 2]
-                frame = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
-                if frame is not None:
-                    self._frame_buffer = frame
-                    self._frame_count += 1
-                frame_data = frame_data[end + 2:]
-
-    async def next_timestamp(self):
-        frame_duration = int(90000 / self.framerate)
-        self._timestamp += frame_duration
-        from fractions import Fraction
-        return self._timestamp, Fraction(1, 90000)
+        consumer = self._consumer
+        while not consumer.closed:
+            captured = consumer.get(timeout=1.0)
+            if captured is not None:
+                self._latest = captured
+                self._loop.call_soon_threadsafe(self._new_frame.set)
+
+    def _decode(self, captured):
+        """JPEG bytes to a planar YUV VideoFrame the encoder can use without conversion"""
+        started = time.time()
+        for frame in self._decoder.decode(Packet(captured.data)):
+            frame = frame.reformat(format="yuv420p")
+            stats.record('decode_time', started)
+            if TIMESTAMP_BARCODE:
+                frame = stamp_video_frame(frame, captured.timestamp)
+            return frame
+        return None
+
+    def capture_timestamp(self, captured):
+        """90 kHz pts from the time the frame left the camera"""
+        if self._first_timestamp is None:
+            self._first_timestamp = captured.timestamp
+        return int((captured.timestamp - self._first_timestamp) * 90000), Fraction(1, 90000)
 
     async def recv(self):
         elapsed_time = time.time() - self._start_time
@@ -86,21 +113,154 @@ class LibcameraVideoStreamTrack(MediaStreamTrack):
             self._start_time = time.time()
             self._frame_count = 0
 
-        count = 0
-        while self._frame_buffer is None:
-            await asyncio.sleep(0.01)
-            count += 1
-            if count > 100:
-                raise RuntimeError("No frames available from camera")
+        while True:
+            # Wait for a frame newer than the last one sent
+            while self._latest is None or self._latest.seq == self._decoded_seq:
+                if self.readyState != "live" or self._consumer is None:
+                    raise MediaStreamError
+                self._new_frame.clear()
+                try:
+                    await asyncio.wait_for(self._new_frame.wait(), FRAME_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if self.readyState == "live" and self._last_frame is not None:
+                        # Camera is restarting or starting up: hold the last
+                        # picture rather than ending the sender
+                        return self._repeat_last_frame()
+
+            captured = self._latest
+            # Decode off the event loop, at the rate aiortc pulls rather than the camera rate
+            frame = await self._loop.run_in_executor(None, self._decode, captured)
+            self._decoded_seq = captured.seq
+            if frame is not None:
+                break
 
-        frame = VideoFrame.from_ndarray(self._frame_buffer.copy(), format="bgr24")
-        frame.pts, frame.time_base = await self.next_timestamp()
+        self._frame_count += 1
+        stats.record('decoded', captured.timestamp)
+        frame.pts, frame.time_base = self.capture_timestamp(captured)
+        self._last_frame = frame
         return frame
 
+    def _repeat_last_frame(self):
+        # A copy, the previous frame may still be queued in the relay
+        frame = av.VideoFrame.from_ndarray(self._last_frame.to_ndarray(), format="yuv420p")
+        frame.pts = max(int((time.time() - self._first_timestamp) * 90000), self._last_frame.pts + 1)
+        frame.time_base = Fraction(1, 90000)
+        self._last_frame = frame
+        return frame
+
+    def capture_time(self, pts):
+        """Inverse of capture_timestamp, for stages further down the relay"""
+        return self._first_timestamp + pts / 90000.0
+
     def stop(self):
-        if self._process:
-            self._process.terminate()
-            self._process = None
+        super().stop()
+        if self._consumer:
+            self._camera.unsubscribe(self._consumer)
+            self._consumer = None
+        if self._owns_camera:
+            self._camera.stop()
+
+class H264PassthroughTrack(MediaStreamTrack):
+    """Forwards libcamera-vid H.264 access units to aiortc as encoded packets.
+
+    aiortc packetizes av.Packet objects directly instead of encoding them, so
+    the Pi's hardware encoder output reaches the browser with no decode or
+    software encode on the way.
+
+    Each viewer gets its own track from viewer(), reading a bounded camera
+    queue: a viewer that falls behind drops to the next keyframe instead of
+    building up latency.
+
+    The camera encoder is not under aiortc's control, so PLI/FIR keyframe
+    requests from the receiver are not honoured: a new viewer (or one that
+    lost packets) waits for the next natural IDR, one every --intra frames
+    (a second by default).
+    """
+    kind = "video"
+
+    def __init__(self, width=1296, height=972, framerate=20, camera=None):
+        super().__init__()
+        if camera is not None and camera.codec != 'h264':
+            raise ValueError("H.264 passthrough needs a camera started with codec='h264'")
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self._owns_camera = camera is None
+        self._camera = camera or CameraService(width=width, height=height,
+                                               framerate=framerate, codec='h264')
+        # Subscribed on the first recv(), so the shared track only holds the camera
+        self._consumer = None
+        self._first_timestamp = None
+        self._need_keyframe = True
+        self._dropped = 0
+        self._start_time = time.time()
+        self._frame_count = 0
+        if self._owns_camera:
+            self._camera.start()
+
+    def viewer(self):
+        """A track for one viewer on the same camera, with its own bounded queue"""
+        return H264PassthroughTrack(self.width, self.height, self.framerate, camera=self._camera)
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        if self._consumer is None:
+            # Keep every access unit, P-frames are useless without their predecessors
+            self._consumer = self._camera.subscribe("webrtc-h264", policy="queue",
+                                                    maxsize=self.framerate * 2)
+        consumer = self._consumer
+
+        loop = asyncio.get_event_loop()
+        while True:
+            captured = await loop.run_in_executor(None, consumer.get, 1.0)
+            if self.readyState != "live" or consumer.closed:
+                raise MediaStreamError
+            if captured is None:
+                continue
+
+            if consumer.dropped != self._dropped:
+                # The queue overflowed, wait for the next IDR to resync the decoder
+                self._dropped = consumer.dropped
+                self._need_keyframe = True
+            if self._need_keyframe:
+                if not captured.keyframe:
+                    continue
+                self._need_keyframe = False
+            break
+
+        if self._first_timestamp is None:
+            self._first_timestamp = captured.timestamp
+
+        self._frame_count += 1
+        elapsed_time = time.time() - self._start_time
+        if elapsed_time > 5:
+            logging.info(f"Forwarding H.264 at {self._frame_count / elapsed_time:.2f} FPS")
+            self._start_time = time.time()
+            self._frame_count = 0
+
+        stats.record('h264_forwarded', captured.timestamp)
+        stats.tick('webrtc_h264')
+        packet = Packet(captured.data)
+        packet.pts = int((captured.timestamp - self._first_timestamp) * 90000)
+        packet.time_base = Fraction(1, 90000)
+        return packet
+
+    def stop(self):
+        super().stop()
+        if self._consumer:
+            self._camera.unsubscribe(self._consumer)
+            self._consumer = None
+        if self._owns_camera:
+            self._camera.stop()
+
+def create_video_track():
+    if WEBRTC_MODE == 'h264':
+        if camera_service is None or camera_service.codec == 'h264':
+            return H264PassthroughTrack(width=1296, height=972, framerate=20, camera=camera_service)
+        # The camera can only run one codec; a shared MJPEG capture wins
+        logging.warning("Shared camera is MJPEG, falling back to re-encoded WebRTC")
+    return LibcameraVideoStreamTrack(width=1296, height=972, framerate=20, camera=camera_service)
 
 @sio.event(namespace='/video')
 def connect():
@@ -111,12 +271,23 @@ def connect():
 def disconnect():
     logging.info("Disconnected from video signaling server")
 
+def send_signal(client_id, signal):
+    signal = dict(signal, clientId=client_id)
+    sio.emit("webrtc-signal", {"target": "control", "signal": signal}, namespace="/video")
+
+def schedule(coro):
+    main_loop.call_soon_threadsafe(asyncio.ensure_future, coro)
+
 @sio.on("webrtc-signal", namespace="/video")
 def on_webrtc_signal(data):
-    global pc
-    if "sdp" in data and "type" in data:
+    client_id = data.get("clientId", DEFAULT_CLIENT_ID)
+    if data.get("type") == "viewer-join":
+        schedule(add_viewer(client_id))
+    elif data.get("type") == "viewer-leave":
+        schedule(remove_viewer(client_id))
+    elif "sdp" in data and "type" in data:
         desc = RTCSessionDescription(sdp=data["sdp"], type=data["type"])
-        main_loop.call_soon_threadsafe(asyncio.ensure_future, handle_remote_description(desc))
+        schedule(handle_remote_description(client_id, desc))
     elif "candidate" in data:
         candidate_dict = data["candidate"]
         candidate = RTCIceCandidate(
@@ -124,33 +295,100 @@ def on_webrtc_signal(data):
             sdpMid=candidate_dict.get('sdpMid'),
             sdpMLineIndex=candidate_dict.get('sdpMLineIndex')
         )
-        main_loop.call_soon_threadsafe(asyncio.ensure_future, pc.addIceCandidate(candidate))
+        schedule(add_ice_candidate(client_id, candidate))
+
+async def add_ice_candidate(client_id, candidate):
+    pc = peers.get(client_id)
+    if pc is None:
+        logging.warning(f"ICE candidate for unknown viewer {client_id}")
+        return
+    await pc.addIceCandidate(candidate)
 
-async def handle_remote_description(desc):
-    global pc
+async def handle_remote_description(client_id, desc):
+    pc = peers.get(client_id)
+    if pc is None:
+        logging.warning(f"SDP {desc.type} for unknown viewer {client_id}")
+        return
     await pc.setRemoteDescription(desc)
     if desc.type == "offer":
         answer = await pc.createAnswer()
         await pc.setLocalDescription(answer)
-        sio.emit("webrtc-signal", {
-            "target": "control",
-            "signal": {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
-        }, namespace="/video")
-        logging.info("Sent SDP answer to control client")
-
-async def start_webrtc():
-    global pc
+        send_signal(client_id, {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type})
+        logging.info(f"Sent SDP answer to viewer {client_id}")
+
+async def add_viewer(client_id):
+    """Open a peer connection for a viewer, fed from the shared camera track"""
+    global source_track
+    if client_id in peers:
+        # Same viewer joining again, e.g. after a page reload
+        await remove_viewer(client_id)
+    if len(peers) >= MAX_VIEWERS:
+        logging.warning(f"Rejecting viewer {client_id}: {len(peers)} viewers connected")
+        send_signal(client_id, {"type": "viewer-rejected",
+                                "reason": f"Viewer limit of {MAX_VIEWERS} reached"})
+        return
+
+    if source_track is None or source_track.readyState != "live":
+        source_track = create_video_track()
+
     pc = RTCPeerConnection()
-    pc.addTrack(LibcameraVideoStreamTrack(width=1296, height=972, framerate=20))
+    peers[client_id] = pc
+
+    @pc.on("connectionstatechange")
+    async def on_connectionstatechange():
+        logging.info(f"Viewer {client_id} connection {pc.connectionState}")
+        if pc.connectionState in ("failed", "closed"):
+            await remove_viewer(client_id, pc)
+
+    controller = None
+    if isinstance(source_track, H264PassthroughTrack):
+        # The packets are already H.264, so only offer that codec. The camera
+        # encoder is shared by every viewer, so there is nothing to adapt per peer.
+        # Not relayed: the relay would queue every packet for a slow viewer
+        sender = pc.addTrack(source_track.viewer())
+        codecs = [c for c in RTCRtpSender.getCapabilities("video").codecs
+                  if c.mimeType.lower() in ("video/h264", "video/rtx")]
+        next(t for t in pc.getTransceivers() if t.sender == sender).setCodecPreferences(codecs)
+    else:
+        # Unbuffered: a viewer whose encoder falls behind gets the newest frame, not a backlog
+        track = AdaptiveVideoTrack(relay.subscribe(source_track, buffered=False),
+                                   capture_time=source_track.capture_time)
+        sender = pc.addTrack(track)
+        controller = QualityController(pc, sender, track)
+
     offer = await pc.createOffer()
     await pc.setLocalDescription(offer)
-    sio.emit("webrtc-signal", {
-        "target": "control",
-        "signal": {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
-    }, namespace="/video")
-    logging.info("Sent SDP offer to control client")
+    send_signal(client_id, {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type})
+    logging.info(f"Sent SDP offer to viewer {client_id} ({len(peers)} watching)")
+    if controller:
+        controller.start()
 
-if __name__ == "__main__":
+async def remove_viewer(client_id, pc=None):
+    """Close a viewer's peer connection, and the camera track after the last one"""
+    global source_track
+    current = peers.get(client_id)
+    if current is None or (pc is not None and current is not pc):
+        return
+    del peers[client_id]
+    # Stop the viewer's track so the relay or the camera stops queueing for it
+    for sender in current.getSenders():
+        if sender.track:
+            sender.track.stop()
+    await current.close()
+    logging.info(f"Viewer {client_id} left ({len(peers)} watching)")
+
+    if not peers and source_track is not None:
+        source_track.stop()
+        source_track = None
+
+def run(camera=None):
+    """Connect to signaling and serve WebRTC, optionally from a shared CameraService"""
+    global camera_service
+    camera_service = camera
+    asyncio.set_event_loop(main_loop)
     sio.connect("http://128.199.26.169:3000/video", namespaces=['/video'])
-    main_loop.run_until_complete(start_webrtc())
-    main_loop.run_forever()
\ No newline at end of file
+    # Peer connections are opened as viewers send viewer-join
+    main_loop.run_forever()
+
+if __name__ == "__main__":
+    run()
\ No newline at end of file